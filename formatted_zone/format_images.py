@@ -2,7 +2,7 @@ import io
 import logging
 from PIL import Image
 from botocore.exceptions import ClientError
-from global_scripts.utils import minio_init
+from global_scripts.utils import minio_init, list_keys, delete_keys
 import dotenv
 import os
 
@@ -24,23 +24,17 @@ def delete_images_from_formatted(s3_client):
     logging.info(f"Preparing to delete all objects in sub-bucket {os.getenv('FORMATTED_ZONE_BUCKET')}/{os.getenv('MEDIA_SUB_BUCKET')}/image")
     prefix_images = f"{os.getenv('MEDIA_SUB_BUCKET')}/image/"
     try:
-        # list objects to delete
-        objects_to_delete = s3_client.list_objects_v2(Bucket=os.getenv("FORMATTED_ZONE_BUCKET"), Prefix=prefix_images)
-        if 'Contents' not in objects_to_delete:
+        # list objects to delete (paginated: a single call stops at 1000 keys)
+        keys = list_keys(s3_client, os.getenv("FORMATTED_ZONE_BUCKET"), prefix_images)
+        if not keys:
             logging.warning(f"No objects found with prefix '{prefix_images}'. Nothing to delete.")
             return True
-        delete_keys = {'Objects': [{'Key': obj['Key']} for obj in objects_to_delete['Contents']]}
 
-        # delete them
-        response = s3_client.delete_objects(Bucket=os.getenv("FORMATTED_ZONE_BUCKET"), Delete=delete_keys)
-
-        if 'Errors' in response:
-            logging.error("An error occurred during bulk delete.")
-            for error in response['Errors']:
-                logging.error(f" - Could not delete '{error['Key']}': {error['Message']}")
+        # delete them (concurrent chunks of at most 1000 keys)
+        if not delete_keys(s3_client, os.getenv("FORMATTED_ZONE_BUCKET"), keys):
             return False
 
-        logging.info(f"Successfully deleted {len(delete_keys['Objects'])} objects from '{prefix_images}'.")
+        logging.info(f"Successfully deleted {len(keys)} objects from '{prefix_images}'.")
         return True
     except ClientError as e:
         logging.error(f"A Boto3 client error occurred: {e}")
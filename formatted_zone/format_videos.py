@@ -4,7 +4,7 @@ import tempfile
 from moviepy.editor import VideoFileClip
 from botocore.exceptions import ClientError
 import dotenv
-from global_scripts.utils import minio_init
+from global_scripts.utils import minio_init, list_keys, delete_keys
 
 dotenv.load_dotenv(dotenv.find_dotenv())
 
@@ -24,23 +24,17 @@ def delete_videos_from_formatted(s3_client):
     logging.info(f"Preparing to delete all objects in sub-bucket {os.getenv('FORMATTED_ZONE_BUCKET')}/{os.getenv('MEDIA_SUB_BUCKET')}/video")
     prefix_videos = f"{os.getenv('MEDIA_SUB_BUCKET')}/video/"
     try:
-        # list objects to delete
-        objects_to_delete = s3_client.list_objects_v2(Bucket=os.getenv('FORMATTED_ZONE_BUCKET'), Prefix=prefix_videos)
-        if 'Contents' not in objects_to_delete:
+        # list objects to delete (paginated: a single call stops at 1000 keys)
+        keys = list_keys(s3_client, os.getenv('FORMATTED_ZONE_BUCKET'), prefix_videos)
+        if not keys:
             logging.warning(f"No objects found with prefix '{prefix_videos}'. Nothing to delete.")
             return True
-        delete_keys = {'Objects': [{'Key': obj['Key']} for obj in objects_to_delete['Contents']]}
 
-        # delete them
-        response = s3_client.delete_objects(Bucket=os.getenv('FORMATTED_ZONE_BUCKET'), Delete=delete_keys)
-
-        if 'Errors' in response:
-            logging.error("An error occurred during bulk delete.")
-            for error in response['Errors']:
-                logging.error(f" - Could not delete '{error['Key']}': {error['Message']}")
+        # delete them (concurrent chunks of at most 1000 keys)
+        if not delete_keys(s3_client, os.getenv('FORMATTED_ZONE_BUCKET'), keys):
             return False
 
-        logging.info(f"Successfully deleted {len(delete_keys['Objects'])} objects from '{prefix_videos}'.")
+        logging.info(f"Successfully deleted {len(keys)} objects from '{prefix_videos}'.")
         return True
     except ClientError as e:
         logging.error(f"A Boto3 client error occurred: {e}")
@@ -1,7 +1,9 @@
 import os
 import boto3
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from botocore.config import Config
 from botocore.exceptions import ClientError, BotoCoreError
 from urllib3.exceptions import HTTPError
 from chromadb import HttpClient
@@ -13,18 +15,30 @@ dotenv.load_dotenv(dotenv.find_dotenv())
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - [%(levelname)s] - %(message)s')
 
-def minio_init():
+# Shared client settings: enough pooled keep-alive connections for the worker threads
+# (botocore's default pool holds 10) and retries on throttling/transient errors
+DEFAULT_CLIENT_CONFIG = Config(
+    max_pool_connections=64,
+    tcp_keepalive=True,
+    retries={'max_attempts': 5, 'mode': 'standard'},
+)
+
+def minio_init(config=None):
     """
     Initialize MinIO S3 client using environment variables.
+    The client is thread-safe and meant to be shared by all the threads of a process.
 
+    :param config: Optional botocore Config (connection pool size, retries, ...), merged over DEFAULT_CLIENT_CONFIG
     :return: Configured S3 client
     """
+    config = DEFAULT_CLIENT_CONFIG if config is None else DEFAULT_CLIENT_CONFIG.merge(config)
     try:
         s3_client = boto3.client(
             "s3",
             endpoint_url=os.getenv("ENDPOINT_URL"),
             aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
             aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+            config=config,
         )
         if not s3_client:
             logging.error("Failed to create MinIO S3 client.")
@@ -177,12 +191,16 @@ def create_bucket(s3_client, bucket):
         logging.info(f"Creating bucket: {bucket}.")
         s3_client.create_bucket(Bucket=bucket)
         logging.info(f"Bucket '{bucket}' created.")
-    except (ClientError, BotoCoreError) as e:
+    except ClientError as e:
         if e.response["Error"]["Code"] == "BucketAlreadyOwnedByYou":
             logging.info(f"Bucket '{bucket}' already exists.")
         else:
             logging.exception(f"Unexpected error creating bucket '{bucket}'.")
             return False
+    except BotoCoreError:
+        # Connection-level errors carry no response to inspect
+        logging.exception(f"Unexpected error creating bucket '{bucket}'.")
+        return False
     except Exception:
         logging.exception(f"Unexpected error creating bucket '{bucket}'.")
         return False
@@ -204,7 +222,7 @@ def create_sub_bucket(s3_client, bucket, key):
         logging.info(f"Sub-bucket '{key}' already exists.")
         return False
     
-    except (ClientError, BotoCoreError) as e:
+    except ClientError as e:
         # If error is 404, then bucket does not exist.
         if e.response["Error"]["Code"] == "404":
             s3_client.put_object(Bucket=bucket, Key=f"{key}/")
@@ -212,12 +230,15 @@ def create_sub_bucket(s3_client, bucket, key):
         else:
             logging.error(f"Unexpected error creating sub-bucket '{key}': {e}")
             return False
+    except BotoCoreError as e:
+        logging.error(f"Unexpected error creating sub-bucket '{key}': {e}")
+        return False
     except Exception:
         logging.exception(f"Unexpected error creating sub-bucket '{key}'.")
         return False
     return True
 
-def ingest_data(s3_client, bucket, fileobj, key):
+def ingest_data(s3_client, bucket, fileobj, key, existing_keys=None):
     """
     Upload new files from data folder to the temporal sub bucket.
 
@@ -225,36 +246,44 @@ def ingest_data(s3_client, bucket, fileobj, key):
     :param bucket: The parent bucket
     :param fileobj: The file object to upload
     :param key: The key (including path) inside the bucket where to upload the file object
+    :param existing_keys: Optional set of keys already in the bucket (see list_keys). When given,
+        existence is checked locally instead of with a HEAD request per file
     :return: True, else False
     """
-    try:
-        # Check if bucket exists
-        s3_client.head_bucket(Bucket=bucket)
+    if existing_keys is None:
+        try:
+            # Check if bucket exists
+            s3_client.head_bucket(Bucket=bucket)
 
-    except ClientError as e:
-        code = e.response["Error"]["Code"]
-        if code == "404" or code == "NoSuchBucket":
-            logging.error(f"Bucket '{bucket}' does not exist.")
-        else:
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code == "404" or code == "NoSuchBucket":
+                logging.error(f"Bucket '{bucket}' does not exist.")
+            else:
+                logging.error(f"Error checking if bucket '{bucket}' exists: {e}")
+            return False
+        except BotoCoreError as e:
             logging.error(f"Error checking if bucket '{bucket}' exists: {e}")
-        return False
-    except BotoCoreError as e:
-        logging.error(f"Error checking if bucket '{bucket}' exists: {e}")
-        return False
-    except Exception:
-        logging.exception(f"Unexpected error checking if bucket '{bucket}' exists.")
-        return False
+            return False
+        except Exception:
+            logging.exception(f"Unexpected error checking if bucket '{bucket}' exists.")
+            return False
 
     # Check if object exists in bucket
     try:
-        s3_client.head_object(Bucket=bucket, Key=key)
-
-        if key.endswith(".bak"):
-            # We always upload backup files, first delete it and then upload it again.
-            s3_client.delete_object(Bucket=bucket, Key=key)
+        if existing_keys is None:
+            s3_client.head_object(Bucket=bucket, Key=key)
+            exists = True
         else:
-            logging.info(f"Skipping already uploaded file: {key}")
-            return False
+            exists = key in existing_keys
+
+        if exists:
+            if key.endswith(".bak"):
+                # We always upload backup files, first delete it and then upload it again.
+                s3_client.delete_object(Bucket=bucket, Key=key)
+            else:
+                logging.info(f"Skipping already uploaded file: {key}")
+                return False
     except ClientError as e:
         if e.response["Error"]["Code"] != "404":
             # Error code == 404 means object does not exist, so we can upload it. All other errors are unexpected.
@@ -335,6 +364,49 @@ def move_to_persistent(s3_client, bucket, temporal_sub_bucket, persistent_sub_bu
         except Exception as e:
             logging.error(e)
 
+def delete_keys(s3_client, bucket, keys, max_workers=8):
+    """
+    Deletes the given keys with DeleteObjects requests of at most 1000 keys (the S3 API
+    limit), issued concurrently. Quiet mode: responses only list the failed keys.
+
+    :param s3_client: Boto3 S3 client
+    :param bucket: The S3 bucket name
+    :param keys: Keys to delete
+    :param max_workers: Number of concurrent DeleteObjects requests
+    :return: True if every key was deleted, False otherwise
+    """
+    chunks = [keys[start:start + 1000] for start in range(0, len(keys), 1000)]
+
+    def delete_chunk(chunk):
+        return s3_client.delete_objects(
+            Bucket=bucket, Delete={'Objects': [{'Key': key} for key in chunk], 'Quiet': True}
+        )
+
+    errors = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for response in executor.map(delete_chunk, chunks):
+            errors.extend(response.get('Errors', []))
+
+    if errors:
+        logging.error("An error occurred during bulk delete.")
+        for error in errors:
+            logging.error(f" - Could not delete '{error['Key']}': {error['Message']}")
+        return False
+    return True
+
+def list_keys(s3_client, bucket, prefix=""):
+    """
+    Lists every key under a prefix, following pagination (a single list_objects_v2 call
+    returns at most 1000 keys).
+
+    :param s3_client: Boto3 S3 client
+    :param bucket: The S3 bucket name
+    :param prefix: The prefix path inside the bucket
+    :return: List of keys
+    """
+    paginator = s3_client.get_paginator('list_objects_v2')
+    return [obj['Key'] for page in paginator.paginate(Bucket=bucket, Prefix=prefix) for obj in page.get('Contents', [])]
+
 def delete_items(s3_client, bucket, prefix=""):
     """
     Deletes all objects in the specified S3 bucket and prefix.
@@ -345,34 +417,13 @@ def delete_items(s3_client, bucket, prefix=""):
     :return: True if deletion was successful, False otherwise
     """
     logging.info(f"Preparing to delete all objects in bucket {bucket}")
-    
-    deleted_count = 0
-    
+
     try:
-        while True:
-            # 1. List the next batch of objects (max 1000)
-            objects_to_delete = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix)
-            
-            # 2. If 'Contents' is missing, the bucket/prefix is empty. We are done.
-            if 'Contents' not in objects_to_delete:
-                break
-            
-            # 3. Prepare the keys for deletion
-            delete_keys = {'Objects': [{'Key': obj['Key']} for obj in objects_to_delete['Contents']]}
-            
-            # 4. Delete this batch
-            response = s3_client.delete_objects(Bucket=bucket, Delete=delete_keys)
-            
-            if 'Errors' in response:
-                logging.error("An error occurred during bulk delete.")
-                for error in response['Errors']:
-                    logging.error(f" - Could not delete '{error['Key']}': {error['Message']}")
-                return False
-            
-            batch_count = len(delete_keys['Objects'])
-            deleted_count += batch_count
+        keys = list_keys(s3_client, bucket, prefix)
+        if not delete_keys(s3_client, bucket, keys):
+            return False
 
-        logging.info(f"Successfully deleted a total of {deleted_count} objects from '{bucket}'.")
+        logging.info(f"Successfully deleted a total of {len(keys)} objects from '{bucket}'.")
         return True
 
     except ClientError as e:
@@ -380,4 +431,56 @@ def delete_items(s3_client, bucket, prefix=""):
         return False
     except Exception as e:
         logging.error(f"An unexpected error occurred: {e}")
-        return False
\ No newline at end of file
+        return False
+
+def source_metadata(source_etag, processing_version):
+    """
+    Metadata stored on a produced object, checked by is_up_to_date on later runs.
+
+    :param source_etag: ETag of the source object, as returned by list_objects_v2
+    :param processing_version: Version of the processing that produced the object
+    :return: Dict to pass as the object's Metadata
+    """
+    return {'source-etag': source_etag.strip('"'), 'processing-version': processing_version}
+
+
+def is_up_to_date(s3_client, bucket, key, source_etag, processing_version):
+    """
+    Checks whether an object was already produced from the current version of its source
+    by the current version of the processing, by comparing the metadata stored at upload
+    time (see source_metadata) with the source's ETag and the processing version.
+
+    :param s3_client: Boto3 S3 client
+    :param bucket: The bucket of the produced object
+    :param key: The key of the produced object
+    :param source_etag: ETag of the source object, as returned by list_objects_v2
+    :param processing_version: Current version of the processing producing the object
+    :return: True if the object exists and was produced from this source and processing version
+    """
+    try:
+        head = s3_client.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+    metadata = head.get('Metadata', {})
+    return all(metadata.get(name) == value for name, value in source_metadata(source_etag, processing_version).items())
+
+
+def delete_stale_items(s3_client, bucket, prefix, keep_keys):
+    """
+    Deletes the objects under a prefix that are not in keep_keys.
+
+    :param s3_client: Boto3 S3 client
+    :param bucket: The S3 bucket name
+    :param prefix: The prefix path inside the bucket
+    :param keep_keys: Keys to keep
+    :return: True if every stale object was deleted, False otherwise
+    """
+    stale_keys = [key for key in list_keys(s3_client, bucket, prefix) if key not in keep_keys]
+    if not delete_keys(s3_client, bucket, stale_keys):
+        logging.error(f"Could not delete all {len(stale_keys)} stale objects from '{bucket}/{prefix}'.")
+        return False
+
+    logging.info(f"Deleted {len(stale_keys)} stale objects from '{bucket}/{prefix}'.")
+    return True
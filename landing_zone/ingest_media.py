@@ -7,7 +7,7 @@ import urllib3
 from tqdm import tqdm
 import io
 import dotenv
-from global_scripts.utils import minio_init, ingest_data, load_games_from_minio
+from global_scripts.utils import minio_init, ingest_data, list_keys, load_games_from_minio
 
 dotenv.load_dotenv(dotenv.find_dotenv())
 
@@ -17,14 +17,21 @@ logging.basicConfig(
     force=True  # override any existing config
 )
 
-def upload_file(s3_client, url, key):
+def upload_file(s3_client, url, key, existing_keys):
     """
     Upload a single media file (image or video) to the temporal sub-bucket.
+    Files already in the sub-bucket are skipped before they are downloaded.
 
     :param s3_client: The S3 client connection
     :param url: The URL of the media file to upload
+    :param existing_keys: Set of keys already in the temporal sub-bucket
     :return: True if upload succeeded, else False
     """
+    key = f"{os.getenv('TEMPORAL_SUB_BUCKET')}/{key}"
+    if key in existing_keys:
+        logging.info(f"Skipping already uploaded file: {key}")
+        return False
+
     timeout = float(os.getenv("DEFAULT_TIMEOUT"))
     sleep = float(os.getenv("DEFAULT_SLEEP"))
     for attempt in range(1, int(os.getenv("DEFAULT_RETRIES")) + 1):
@@ -35,9 +42,8 @@ def upload_file(s3_client, url, key):
             if int(response.headers.get("Content-Length", 0)) == 0:
                 logging.warning(f"Skipping empty response from {url}")
                 return False
-            key = f"{os.getenv('TEMPORAL_SUB_BUCKET')}/{key}"
             fileobj = io.BytesIO(response.content)
-            return ingest_data(s3_client, os.getenv('LANDING_ZONE_BUCKET'), fileobj, key)
+            return ingest_data(s3_client, os.getenv('LANDING_ZONE_BUCKET'), fileobj, key, existing_keys)
 
 
         # Exponential backoff for retries
@@ -62,6 +68,9 @@ def upload_concurrently(s3_client, media):
     :param media: Dictionary with media URLs
     """
     try:
+        # Keys already uploaded, listed once instead of checked with a HEAD request per file
+        existing_keys = set(list_keys(s3_client, os.getenv('LANDING_ZONE_BUCKET'), f"{os.getenv('TEMPORAL_SUB_BUCKET')}/"))
+
         # Upload each file concurrently
         with ThreadPoolExecutor(max_workers=int(os.getenv("MAX_THREADS"))) as executor:
             futures = []
@@ -70,13 +79,13 @@ def upload_concurrently(s3_client, media):
                     if image_file:
                         ext = image_file.split('/')[-1].split('?')[0].split('.')[-1]
                         key = f"{game_id}_{image_idx}.{ext}"
-                        futures.append(executor.submit(upload_file, s3_client, image_file, key))
+                        futures.append(executor.submit(upload_file, s3_client, image_file, key, existing_keys))
 
                 for video_idx, video_file in enumerate([game_info.get("video", None)], start=1):
                     if video_file:
                         ext = video_file.split('/')[-1].split('?')[0].split('.')[-1]
                         key = f"{game_id}_{video_idx}.{ext}"
-                        futures.append(executor.submit(upload_file, s3_client, video_file, key))
+                        futures.append(executor.submit(upload_file, s3_client, video_file, key, existing_keys))
 
             # Wait for all uploads to complete
             fail = 0
@@ -1,8 +1,9 @@
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from botocore.exceptions import ClientError
-from global_scripts.utils import minio_init
+from global_scripts.utils import minio_init, list_keys, delete_keys
 import dotenv
 
 dotenv.load_dotenv(dotenv.find_dotenv())
@@ -13,6 +14,9 @@ logging.basicConfig(
     force=True  # override any existing config
 )
 
+# Concurrent server-side copies to persistent storage
+COPY_WORKERS = 16
+
 def delete_media(s3_client, bucket, prefix):
     """
     Deletes all objects in the specified media sub-bucket.
@@ -25,23 +29,17 @@ def delete_media(s3_client, bucket, prefix):
     logging.info(f"Preparing to delete all objects in sub-bucket {bucket}/{prefix}")
     
     try:
-        # list objects to delete
-        objects_to_delete = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix)
-        if 'Contents' not in objects_to_delete:
+        # list objects to delete (paginated: a single call stops at 1000 keys)
+        keys = list_keys(s3_client, bucket, prefix)
+        if not keys:
             logging.warning(f"No objects found with prefix '{prefix}'. Nothing to delete.")
             return True
-        delete_keys = {'Objects': [{'Key': obj['Key']} for obj in objects_to_delete['Contents']]}
-
-        # delete them
-        response = s3_client.delete_objects(Bucket=bucket, Delete=delete_keys)
 
-        if 'Errors' in response:
-            logging.error("An error occurred during bulk delete.")
-            for error in response['Errors']:
-                logging.error(f" - Could not delete '{error['Key']}': {error['Message']}")
+        # delete them, in DeleteObjects batches of at most 1000 keys
+        if not delete_keys(s3_client, bucket, keys):
             return False
 
-        logging.info(f"Successfully deleted {len(delete_keys['Objects'])} objects from '{prefix}'.")
+        logging.info(f"Successfully deleted {len(keys)} objects from '{prefix}'.")
         return True
     except ClientError as e:
         logging.error(f"A Boto3 client error occurred: {e}")
@@ -51,59 +49,76 @@ def delete_media(s3_client, bucket, prefix):
         return False
 
 
+def persistent_key(key, timestamp):
+    """
+    Name of a temporal landing object in persistent storage, following the naming convention.
+
+    :param key: Key of the object in the temporal sub-bucket
+    :param timestamp: Timestamp of the move, shared by the whole batch
+    :return: Key in the persistent sub-bucket, or None if the file type is not handled
+    """
+    filename = key.split("/")[-1]
+    if key.endswith(".json"):
+        source = filename.split("_")[0]
+        return f"{os.getenv('PERSISTENT_SUB_BUCKET')}/json/{source}/{source}#{timestamp}#games.json"
+
+    game_id = filename.split("_")[0]
+    if key.endswith(".jpg"):
+        media_num = filename.split("_")[1].split(".")[0]
+        return f"{os.getenv('PERSISTENT_SUB_BUCKET')}/media/image/{timestamp}#{game_id}#{media_num}.jpg"
+    if key.endswith(".mp4"):
+        media_num = filename.split("_")[1].split(".")[0]
+        return f"{os.getenv('PERSISTENT_SUB_BUCKET')}/media/video/{timestamp}#{game_id}#{media_num}.mp4"
+    return None
+
+
 def main():
 
     # MinIO client connection, using Amazon S3 API and boto3 Python library
     s3_client = minio_init()
+    bucket = os.getenv("LANDING_ZONE_BUCKET")
 
     # delete old images (we assume images are not updated so we delete old to insert new ones)
-    del_img = delete_media(s3_client=s3_client, bucket=os.getenv("LANDING_ZONE_BUCKET"), 
+    del_img = delete_media(s3_client=s3_client, bucket=bucket, 
                             prefix=f"{os.getenv('PERSISTENT_SUB_BUCKET')}/media/image/")
 
     # delete old videos (we assume videos are not updated so we delete old to insert new ones)
-    del_vid = delete_media(s3_client=s3_client, bucket=os.getenv("LANDING_ZONE_BUCKET"), 
+    del_vid = delete_media(s3_client=s3_client, bucket=bucket, 
                             prefix=f"{os.getenv('PERSISTENT_SUB_BUCKET')}/media/video/")
 
     if del_img and del_vid:
         try:
-            objects = s3_client.list_objects_v2(Bucket=os.getenv("LANDING_ZONE_BUCKET"), Prefix=f"{os.getenv('TEMPORAL_SUB_BUCKET')}/")
-            if "Contents" in objects:
-                moving_objects = [obj for obj in objects["Contents"] if not obj['Key'].endswith(("/", ".bak"))]
-                delete_objects = [obj for obj in objects["Contents"] if not obj['Key'].endswith("/")]
-                for obj in moving_objects:
-                    logging.info(f"Preparing to move object {obj['Key']} to persistent storage.")
-                    if obj['Key'].endswith(".json"):
-                        ext = "json"
-                        source = obj['Key'].split("/")[-1].split("_")[0]
-                        sub_bucket = f"{source}"
-                        convention_name = f"{os.getenv('PERSISTENT_SUB_BUCKET')}/{ext}/{sub_bucket}/"
-                        convention_name += f"{source}#{datetime.now().strftime('%Y%m%d_%H%M%S')}#games.json"
-                    elif obj['Key'].endswith(".jpg"):
-                        game_id = obj['Key'].split("/")[-1].split("_")[0]
-                        media_num = obj['Key'].split("/")[-1].split("_")[1].split(".")[0]
-                        convention_name = f"{os.getenv('PERSISTENT_SUB_BUCKET')}/media/image/"
-                        convention_name += f"{datetime.now().strftime('%Y%m%d_%H%M%S')}#{game_id}#{media_num}.jpg"
-                    elif obj['Key'].endswith(".mp4"):
-                        game_id = obj['Key'].split("/")[-1].split("_")[0]
-                        media_num = obj['Key'].split("/")[-1].split("_")[1].split(".")[0]
-                        convention_name = f"{os.getenv('PERSISTENT_SUB_BUCKET')}/media/video/"
-                        convention_name += f"{datetime.now().strftime('%Y%m%d_%H%M%S')}#{game_id}#{media_num}.mp4"
+            keys = [key for key in list_keys(s3_client, bucket, f"{os.getenv('TEMPORAL_SUB_BUCKET')}/") if not key.endswith("/")]
+            if keys:
+                moving_keys = [key for key in keys if not key.endswith(".bak")]
+
+                # One timestamp for the whole batch
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+                def copy(key):
+                    convention_name = persistent_key(key, timestamp)
+                    if convention_name is None:
+                        logging.warning(f"Unknown file type, not moved to persistent storage: {key}")
+                        return False
                     s3_client.copy_object(
-                        Bucket=os.getenv("LANDING_ZONE_BUCKET"),
+                        Bucket=bucket,
                         CopySource={
-                            "Bucket": os.getenv("LANDING_ZONE_BUCKET"),
-                            "Key": obj["Key"]
+                            "Bucket": bucket,
+                            "Key": key
                         },
                         Key=convention_name
                     )
-                    logging.info(f"Copied object {obj['Key']} to persistent storage.")
-                s3_client.delete_objects(
-                    Bucket=os.getenv("LANDING_ZONE_BUCKET"),
-                    Delete={
-                        'Objects': [{'Key': obj['Key']} for obj in delete_objects],
-                        'Quiet': True
-                    })
-                logging.info("Data successfully moved to persistent storage.")
+                    logging.info(f"Copied object {key} to persistent storage.")
+                    return True
+
+                # Server-side copies issued concurrently; a failed copy raises before anything is deleted
+                with ThreadPoolExecutor(max_workers=COPY_WORKERS) as executor:
+                    copied = [key for key, ok in zip(moving_keys, executor.map(copy, moving_keys)) if ok]
+
+                # Only the moved files and the backups leave temporal storage; unknown files stay
+                backups = [key for key in keys if key.endswith(".bak")]
+                if delete_keys(s3_client, bucket, copied + backups):
+                    logging.info("Data successfully moved to persistent storage.")
             else:
                 logging.info("No objects found in temporal storage.")   
         except Exception:
@@ -112,4 +127,4 @@ def main():
     
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -110,7 +110,8 @@ def main():
         return
 
     # Step 2: Augment each image in train split
-    augmented_rows = []
+    # Augmented rows are collected column-wise
+    augmented_rows = {"image_path": [], "description": [], "game_id": []}
     total_images = len(train_df)
     num_augmentations = 3  # Create 3 augmented versions per image
 
@@ -150,13 +151,15 @@ def main():
                 s3_client.upload_fileobj(aug_img_buffer, training_bucket, aug_key)
 
                 # Add to augmented rows list
-                augmented_rows.append({"image_path": aug_key, "description": description, "game_id": game_id})
+                augmented_rows["image_path"].append(aug_key)
+                augmented_rows["description"].append(description)
+                augmented_rows["game_id"].append(game_id)
 
         except Exception as e:
             logging.error(f"Error augmenting image {image_path}: {e}")
             continue
 
-    logging.info(f"Successfully created {len(augmented_rows)} augmented images.")
+    logging.info(f"Successfully created {len(augmented_rows['image_path'])} augmented images.")
 
     # Step 3: Combine original and augmented data
     augmented_df = pd.DataFrame(augmented_rows)
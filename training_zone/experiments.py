@@ -4,12 +4,15 @@ import json
 import logging
 import os
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO, StringIO
 
 import torch
+from device_utils import to_device
 from dotenv import find_dotenv, load_dotenv
 from global_scripts.utils import minio_init
 from metrics import compute_all_metrics
+from model_store import download_latest_model
 from peft import PeftModel
 from PIL import Image
 from tqdm import tqdm
@@ -45,46 +48,9 @@ def load_model_from_minio(s3_client, technique, device):
     if pattern == "qlora" and device != "cuda":
         raise EnvironmentError("QLoRA requires a CUDA-capable GPU, but none was found.")
 
-    # List all models with this technique and get the most recent one
-    technique_prefix = f"models/{pattern}/"
-    response = s3_client.list_objects_v2(Bucket=bucket, Prefix=technique_prefix, Delimiter="/")
-    matching_dirs = []
-
-    for prefix in response.get("CommonPrefixes", []):
-        dir_name = prefix["Prefix"].rstrip("/")
-        matching_dirs.append(dir_name)
-
-    if not matching_dirs:
-        raise FileNotFoundError(
-            f"No trained model found for technique '{technique}' in bucket '{bucket}/{technique_prefix}'"
-        )
-
-    # Sort by timestamp (assuming format: YYYYMMDD_HHMMSS_...)
-    matching_dirs.sort(reverse=True)
-    latest_model_dir = matching_dirs[0]
-    minio_path = f"{latest_model_dir}"
-
-    logging.info(f"Loading model from {bucket}/{minio_path}...")
-
     with tempfile.TemporaryDirectory() as temp_dir:
-        # List all objects in the minio_path
-        response = s3_client.list_objects_v2(Bucket=bucket, Prefix=minio_path)
-
-        for obj in response.get("Contents", []):
-            key = obj["Key"]
-            # Get relative path from minio_path
-            relative_path = key[len(minio_path) :].lstrip("/")
-            if not relative_path:
-                continue
-
-            local_file_path = os.path.join(temp_dir, relative_path)
-            os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
-
-            # Download file
-            file_response = s3_client.get_object(Bucket=bucket, Key=key)
-            with open(local_file_path, "wb") as f:
-                f.write(file_response["Body"].read())
-            logging.info(f"Downloaded {relative_path} from {bucket}/{key}")
+        # Most recent model of the technique (weights, configs and processor files)
+        download_latest_model(s3_client, bucket, f"models/{pattern}/", temp_dir)
 
         # Load model and processor from temporary directory
         adapter_config_path = os.path.join(temp_dir, "adapter_config.json")
@@ -92,11 +58,11 @@ def load_model_from_minio(s3_client, technique, device):
         if os.path.exists(adapter_config_path):
             # It's a PEFT model - load base model first, then apply PEFT
             logging.info("Detected PEFT model (LoRA/QLoRA), loading with PEFT...")
-            base_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
+            base_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32", low_cpu_mem_usage=True)
             model = PeftModel.from_pretrained(base_model, temp_dir).to(device)
         else:
             # Regular fine-tuned model
-            model = CLIPModel.from_pretrained(temp_dir).to(device)
+            model = CLIPModel.from_pretrained(temp_dir, low_cpu_mem_usage=True).to(device)
 
         processor = CLIPProcessor.from_pretrained(temp_dir)
 
@@ -139,31 +105,21 @@ def load_images_and_descriptions(s3_client, test_data) -> list:
         list: List of dictionaries with 'image' (PIL Image) and 'description' (str).
     """
     bucket = os.getenv("TRAINING_ZONE_BUCKET", "training-zone")
-    loaded_data = []
 
     logging.info(f"Loading {len(test_data)} images from S3...")
 
-    for idx, item in enumerate(test_data):
+    def load_item(item):
+        # Download and decode in the worker thread (PIL releases the GIL while decoding)
         try:
-            image_path = item["image_path"]
-            description = item["description"]
-            id = item["id"]
-
-            # Download image from MinIO
-            response = s3_client.get_object(Bucket=bucket, Key=image_path)
-            image_bytes = response["Body"].read()
-
-            # Load image with PIL
-            image = Image.open(BytesIO(image_bytes)).convert("RGB")
-
-            loaded_data.append({"image": image, "description": description, "id": id})
-
-            if (idx + 1) % 50 == 0:
-                logging.info(f"Loaded {idx + 1}/{len(test_data)} images...")
-
+            response = s3_client.get_object(Bucket=bucket, Key=item["image_path"])
+            image = Image.open(BytesIO(response["Body"].read())).convert("RGB")
+            return {"image": image, "description": item["description"], "id": item["id"]}
         except Exception as e:
             logging.error(f"Error loading image {item.get('image_path', 'unknown')}: {e}")
-            continue
+            return None
+
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        loaded_data = [entry for entry in executor.map(load_item, test_data) if entry is not None]
 
     logging.info(f"Successfully loaded {len(loaded_data)}/{len(test_data)} images.")
     return loaded_data
@@ -205,20 +161,24 @@ def main(args):
             game_ids.append(game_id)
 
             # Process image
-            image_inputs = processor(images=image, return_tensors="pt").to(device)
-            image_features = model.get_image_features(**image_inputs)
-            image_embeddings.append(image_features.cpu())
+            image_inputs = processor(images=image, return_tensors="pt")
+            image_features = model.get_image_features(pixel_values=to_device(image_inputs["pixel_values"], device))
+            # Kept on the device: a per-item .cpu() would synchronize on every iteration
+            image_embeddings.append(image_features)
 
             # Process text
             text_inputs = processor(
                 text=[description], return_tensors="pt", padding=True, truncation=True, max_length=77
-            ).to(device)
-            text_features = model.get_text_features(**text_inputs)
-            text_embeddings.append(text_features.cpu())
-
-    # Stack embeddings into tensors
-    image_embeddings = torch.cat(image_embeddings, dim=0)  # [N, embed_dim]
-    text_embeddings = torch.cat(text_embeddings, dim=0)  # [N, embed_dim]
+            )
+            text_features = model.get_text_features(
+                input_ids=to_device(text_inputs["input_ids"], device),
+                attention_mask=to_device(text_inputs["attention_mask"], device),
+            )
+            text_embeddings.append(text_features)
+
+    # Stack embeddings into tensors, moved to the host in one transfer each
+    image_embeddings = torch.cat(image_embeddings, dim=0).cpu()  # [N, embed_dim]
+    text_embeddings = torch.cat(text_embeddings, dim=0).cpu()  # [N, embed_dim]
 
     # Normalize embeddings
     image_embeddings = image_embeddings / image_embeddings.norm(dim=-1, keepdim=True)
@@ -5,8 +5,21 @@ import tempfile
 from datetime import datetime
 
 import torch
+from bitsandbytes.optim import PagedAdamW8bit
 from dotenv import find_dotenv, load_dotenv
-from fine_tune_utils import SteamDatasetHF, setup_config
+from fine_tune_utils import (
+    SteamDatasetHF,
+    build_cache,
+    build_gpu_augmentation,
+    cache_complete,
+    cache_key,
+    clip_loss_unique_text,
+    collate_dynamic_padding,
+    dali_available,
+    dataset_worker_init,
+    prefetch_to_local,
+    setup_config,
+)
 from global_scripts.utils import minio_init
 from peft import LoraConfig, get_peft_model
 from torch.amp.autocast_mode import autocast
@@ -91,6 +104,7 @@ def main(args):
         model = CLIPModel.from_pretrained(
             CONFIG["model_id"],
             quantization_config=bnb_config,
+            torch_dtype=getattr(torch, CONFIG["bnb_4bit_compute_dtype"]),  # Non-quantized layers match the inputs
             device_map="auto",  # Automatically place layers on available devices
         )
     else:
@@ -100,6 +114,10 @@ def main(args):
 
     processor = CLIPProcessor.from_pretrained(CONFIG["model_id"])
 
+    if CONFIG["gradient_checkpointing"]:
+        # Recompute encoder activations during backward instead of storing them (before PEFT wrapping)
+        model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={"use_reentrant": False})
+
     if technique in ["lora", "qlora"]:
         peft_config = LoraConfig(
             r=CONFIG["lora_r"],
@@ -107,97 +125,168 @@ def main(args):
             target_modules=CONFIG["lora_matrices"],
             lora_dropout=CONFIG["lora_dropout"],
             bias="none",
+            modules_to_save=None,  # Only the adapters train: no fp32 copies of logit_scale or heads
         )
+        trainable_before = sum(p.numel() for p in model.parameters() if p.requires_grad)
         # Get LoRA model: freezes base model and enables gradients for adapters (AxB)
         model = get_peft_model(model, peft_config)
-        model.print_trainable_parameters()
+        trainable_after = sum(p.numel() for p in model.parameters() if p.requires_grad)
+        logging.info(f"Trainable parameters: {trainable_before:,} before LoRA, {trainable_after:,} after")
+        unexpected = [n for n, p in model.named_parameters() if p.requires_grad and "lora_" not in n]
+        if unexpected:
+            raise RuntimeError(f"Non-LoRA parameters left trainable: {unexpected}")
+
+    # The loss runs the two towers separately (text once per unique description); it is
+    # compiled instead of the model so the tower calls are captured too. Shapes vary per
+    # batch (dynamic padding of the text, number of unique descriptions from the
+    # data-dependent torch.unique, which also graph-breaks), so it is compiled with dynamic
+    # shapes instead of being specialized and recompiled for every new sequence length.
+    # CUDA graphs stay off: a graph per sequence length would be recorded, and replaying one
+    # overwrites the loss tensors kept in train_losses until the end of the epoch
+    loss_fn = clip_loss_unique_text
+    if CONFIG["compile"] and CONFIG["device"] == "cuda":
+        logging.info("Compiling loss with torch.compile...")
+        loss_fn = torch.compile(
+            clip_loss_unique_text, mode="max-autotune-no-cudagraphs", dynamic=True, fullgraph=False
+        )
 
-    # Prepare data
+    # Prepare data: download the images once to local disk, then pre-process every split
+    # once into a local memory-mapped cache, keyed by content so later runs reuse it
     logging.info("Preparing data...")
-    train_dataset = SteamDatasetHF(s3_client, train_csv_data, processor)
-    val_dataset = SteamDatasetHF(s3_client, val_csv_data, processor)
+    cache_dir = os.path.join(tempfile.gettempdir(), "clip_cache")
+    image_dir = os.path.join(cache_dir, "images")
+    use_dali = CONFIG["dali"] and CONFIG["device"] == "cuda" and dali_available()
+    train_cache = os.path.join(cache_dir, cache_key(train_csv_data, processor, use_dali))
+    val_cache = os.path.join(cache_dir, cache_key(val_csv_data, processor, use_dali))
+
+    for csv_data, cache_path in ((train_csv_data, train_cache), (val_csv_data, val_cache)):
+        # The images are only read to build a cache: a complete one serves every sample
+        if not cache_complete(cache_path):
+            prefetch_to_local(s3_client, csv_data, image_dir)
+        build_cache(s3_client, csv_data, processor, cache_path, local_dir=image_dir, use_dali=use_dali)
+
+    # Pixel values leave the workers already in the dtype the model consumes, so the
+    # host-to-device copy carries half the bytes for fp16/bf16 training
+    if technique == "fp16":
+        pixel_dtype = torch.float16
+    elif technique == "qlora":
+        pixel_dtype = getattr(torch, CONFIG["bnb_4bit_compute_dtype"])
+    else:
+        pixel_dtype = torch.float32
 
-    train_loader = DataLoader(train_dataset, batch_size=CONFIG["batch_size"], shuffle=True)
-    val_loader = DataLoader(val_dataset, batch_size=CONFIG["batch_size"], shuffle=False)
+    train_dataset = SteamDatasetHF(
+        s3_client, train_csv_data, processor, cache_path=train_cache, local_dir=image_dir, pixel_dtype=pixel_dtype
+    )
+    val_dataset = SteamDatasetHF(
+        s3_client, val_csv_data, processor, cache_path=val_cache, local_dir=image_dir, pixel_dtype=pixel_dtype
+    )
+
+    # Cached datasets never touch MinIO, so their workers need no client of their own
+    train_worker_init = None if train_dataset.cache_path else dataset_worker_init
+    val_worker_init = None if val_dataset.cache_path else dataset_worker_init
+
+    # drop_last keeps the batch dimension fixed (a short last batch would also have few negatives)
+    train_loader = DataLoader(
+        train_dataset,
+        batch_size=CONFIG["batch_size"],
+        shuffle=True,
+        drop_last=True,
+        num_workers=CONFIG["num_workers"],
+        worker_init_fn=train_worker_init,
+        collate_fn=collate_dynamic_padding,
+        pin_memory=CONFIG["device"] == "cuda",
+    )
+    val_loader = DataLoader(
+        val_dataset,
+        batch_size=CONFIG["batch_size"],
+        shuffle=False,
+        num_workers=CONFIG["num_workers"],
+        worker_init_fn=val_worker_init,
+        collate_fn=collate_dynamic_padding,
+        pin_memory=CONFIG["device"] == "cuda",
+    )
 
-    # Optimizer
-    optimizer = AdamW(model.parameters(), lr=CONFIG["learning_rate"], weight_decay=CONFIG["weight_decay"])
+    # Optimizer (built from a one-time list of trainable parameters: only the adapters for LoRA/QLoRA)
+    trainable_params = [p for p in model.parameters() if p.requires_grad]
+    logging.info(f"Optimizing {sum(p.numel() for p in trainable_params):,} parameters")
+    if CONFIG["device"] == "cuda":
+        # Store the Adam moments blockwise-quantized to 8 bits in paged (unified) memory to
+        # absorb memory spikes (LoRA adapters are kept in fp32, so their state is not negligible)
+        optimizer = PagedAdamW8bit(trainable_params, lr=CONFIG["learning_rate"], weight_decay=CONFIG["weight_decay"])
+    else:
+        optimizer = AdamW(trainable_params, lr=CONFIG["learning_rate"], weight_decay=CONFIG["weight_decay"])
 
     if technique == "fp16":
         scaler = GradScaler()
 
+    # Batched augmentation on the GPU, applied to training batches only
+    gpu_aug = build_gpu_augmentation(processor).to(CONFIG["device"]) if CONFIG["gpu_augmentation"] else None
+
     # Training loop
     best_val_loss = float("inf")
     patience_counter = 0
     logging.info("Starting training...")
     for epoch in range(CONFIG["epochs"]):
         model.train()
-        total_train_loss = 0
-
-        for batch in tqdm(train_loader, desc=f"Epoch {epoch + 1}/{CONFIG['epochs']}"):
-            # Move batch to device
-            token_ids = batch["token_ids"].to(CONFIG["device"])
-            attention_mask = batch["attention_mask"].to(CONFIG["device"])
-            pixel_values = batch["pixel_values"].to(CONFIG["device"])
+        # Losses stay on the device; a single sync per epoch when averaging
+        train_losses = []
 
-            optimizer.zero_grad()
+        optimizer.zero_grad(set_to_none=True)
 
-            # Forward pass
+        for step, batch in enumerate(tqdm(train_loader, desc=f"Epoch {epoch + 1}/{CONFIG['epochs']}"), start=1):
+            # Move batch to device
+            token_ids = batch["token_ids"].to(CONFIG["device"], non_blocking=True)
+            attention_mask = batch["attention_mask"].to(CONFIG["device"], non_blocking=True)
+            pixel_values = batch["pixel_values"].to(CONFIG["device"], non_blocking=True)
+            desc_ids = batch["desc_ids"].to(CONFIG["device"], non_blocking=True)
+            if gpu_aug is not None:
+                # Augment in fp32, then return to the dtype the dataset produced
+                pixel_values = gpu_aug(pixel_values.float()).to(pixel_values.dtype)
+
+            # Forward pass (loss is scaled so accumulated gradients average over the micro-batches)
             if technique == "fp16":
                 with autocast("cuda", dtype=torch.float16):
-                    outputs = model(
-                        input_ids=token_ids,
-                        attention_mask=attention_mask,
-                        pixel_values=pixel_values,
-                        return_loss=True,
-                    )
-                scaler.scale(outputs.loss).backward()
-                scaler.step(optimizer)
-                scaler.update()
+                    loss = loss_fn(model, token_ids, attention_mask, pixel_values, desc_ids)
+                scaler.scale(loss / CONFIG["grad_accum_steps"]).backward()
             else:
-                outputs = model(
-                    input_ids=token_ids,
-                    attention_mask=attention_mask,
-                    pixel_values=pixel_values,
-                    return_loss=True,
-                )
+                loss = loss_fn(model, token_ids, attention_mask, pixel_values, desc_ids)
 
                 # Backward pass
-                outputs.loss.backward()
-                optimizer.step()
+                (loss / CONFIG["grad_accum_steps"]).backward()
+
+            # Optimizer step every grad_accum_steps micro-batches (and on the last one of the epoch)
+            if step % CONFIG["grad_accum_steps"] == 0 or step == len(train_loader):
+                if technique == "fp16":
+                    scaler.step(optimizer)
+                    scaler.update()
+                else:
+                    optimizer.step()
+                optimizer.zero_grad(set_to_none=True)
 
-            total_train_loss += outputs.loss.item()
+            train_losses.append(loss.detach())
 
-        avg_train_loss = total_train_loss / len(train_loader)
+        avg_train_loss = torch.stack(train_losses).mean().item()
 
         # Validation
         model.eval()
-        total_val_loss = 0
-        with torch.no_grad():
+        val_losses = []
+        with torch.inference_mode():
             for batch in val_loader:
-                token_ids = batch["token_ids"].to(CONFIG["device"])
-                attention_mask = batch["attention_mask"].to(CONFIG["device"])
-                pixel_values = batch["pixel_values"].to(CONFIG["device"])
+                token_ids = batch["token_ids"].to(CONFIG["device"], non_blocking=True)
+                attention_mask = batch["attention_mask"].to(CONFIG["device"], non_blocking=True)
+                pixel_values = batch["pixel_values"].to(CONFIG["device"], non_blocking=True)
+                desc_ids = batch["desc_ids"].to(CONFIG["device"], non_blocking=True)
 
+                # Eager loss: compiling it again for inference mode is not worth it for validation
                 if technique == "fp16":
                     with autocast("cuda", dtype=torch.float16):
-                        outputs = model(
-                            input_ids=token_ids,
-                            attention_mask=attention_mask,
-                            pixel_values=pixel_values,
-                            return_loss=True,
-                        )
+                        loss = clip_loss_unique_text(model, token_ids, attention_mask, pixel_values, desc_ids)
                 else:
-                    outputs = model(
-                        input_ids=token_ids,
-                        attention_mask=attention_mask,
-                        pixel_values=pixel_values,
-                        return_loss=True,
-                    )
+                    loss = clip_loss_unique_text(model, token_ids, attention_mask, pixel_values, desc_ids)
 
-                total_val_loss += outputs.loss.item()
+                val_losses.append(loss)
 
-        avg_val_loss = total_val_loss / len(val_loader)
+        avg_val_loss = torch.stack(val_losses).mean().item()
 
         logging.info(
             f"[Epoch {epoch + 1}/{CONFIG['epochs']}] Train Loss: {avg_train_loss:.4f} | Val Loss: {avg_val_loss:.4f}"
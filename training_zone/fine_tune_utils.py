@@ -1,21 +1,36 @@
+import hashlib
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO, StringIO
 
+import numpy as np
 import pandas as pd
 import torch
+from botocore.config import Config
+from global_scripts.utils import minio_init
 from PIL import Image
-from torch.utils.data import Dataset
-from torchvision import transforms  
+from torch import nn
+from torch.utils.data import Dataset, get_worker_info
 
 BASE_CONFIG = {
     "model_id": "openai/clip-vit-base-patch32",
     "epochs": 1,
     "batch_size": 8,
+    "num_workers": 4,  # DataLoader worker processes
+    # Micro-batches per optimizer step: averages the gradients of 4 x 8 pairs, but it is not a
+    # batch of 32 for the contrastive loss, which only contrasts the 8 pairs of each micro-batch
+    "grad_accum_steps": 4,
     "learning_rate": 5e-6,
     #"learning_rate": 3e-5,
     "patience": 5,
     "weight_decay": 0.1,
+    "gradient_checkpointing": True,  # Trade ~30% extra compute for much lower activation memory
+    "compile": True,  # torch.compile the training loss (both towers) on CUDA, with dynamic shapes
+    # Decode/resize/normalize the image cache with NVIDIA DALI on CUDA (nvJPEG). Off by default:
+    # DALI's bicubic resize does not match the HF processor used at evaluation bit for bit
+    "dali": False,
+    "gpu_augmentation": False,  # On-the-fly batched augmentation on the GPU (train.csv is already augmented offline)
     "device": "cuda" if torch.cuda.is_available() else "cpu",
 }
 
@@ -33,13 +48,23 @@ LORA_CONFIG = {
 QUANT_CONFIG = {
     # Quantization config (4-bit)
     "load_in_4bit": True,
-    "bnb_4bit_compute_dtype": "float32",  # Computation dtype
+    "bnb_4bit_compute_dtype": "bfloat16",  # Computation dtype: NF4 weights dequantize to bf16 for tensor-core matmuls
     "bnb_4bit_quant_type": "nf4",  # Quantization type: "nf4" or "fp4"
     "bnb_4bit_use_double_quant": True,  # Nested quantization for more memory savings
     "device": "cuda" if torch.cuda.is_available() else "cpu",
 }
 
 
+# Shapes of the processor outputs stored in the on-disk cache (see build_cache)
+CACHE_IMAGE_SHAPE = (3, 224, 224)
+CACHE_TEXT_LENGTH = 77
+# File written once a cache is complete
+CACHE_COMPLETE_MARKER = "complete"
+
+# Number of threads each dataset (per DataLoader worker) uses to fetch images from MinIO
+PREFETCH_THREADS = 8
+
+
 def setup_config(technique):
     match technique:
         case "qlora":
@@ -51,8 +76,371 @@ def setup_config(technique):
     return CONFIG
 
 
+def load_csv_data(csv_data):
+    """
+    Load a data split into a DataFrame.
+
+    :param csv_data: Either a pandas DataFrame or a CSV string/bytes
+    :return: pandas DataFrame with the split rows
+    """
+    if isinstance(csv_data, pd.DataFrame):
+        return csv_data
+    if isinstance(csv_data, (str, bytes)):
+        return pd.read_csv(StringIO(csv_data) if isinstance(csv_data, str) else BytesIO(csv_data))
+    raise ValueError("csv_data must be a pandas DataFrame, string, or bytes")
+
+
+def open_cache(cache_path, n_rows, mode="r"):
+    """
+    Open the memory-mapped processor outputs of a split.
+
+    :param cache_path: Local directory holding the cache files
+    :param n_rows: Number of rows in the split
+    :param mode: numpy memmap mode ("r" to read, "w+" to create)
+    :return: Tuple of (pixel_values, token_ids, attention_mask) memmaps
+    """
+    pixel_values = np.memmap(
+        os.path.join(cache_path, "pixel_values.dat"), dtype=np.float16, mode=mode, shape=(n_rows, *CACHE_IMAGE_SHAPE)
+    )
+    token_ids = np.memmap(
+        os.path.join(cache_path, "token_ids.dat"), dtype=np.int32, mode=mode, shape=(n_rows, CACHE_TEXT_LENGTH)
+    )
+    attention_mask = np.memmap(
+        os.path.join(cache_path, "attention_mask.dat"), dtype=np.int32, mode=mode, shape=(n_rows, CACHE_TEXT_LENGTH)
+    )
+    return pixel_values, token_ids, attention_mask
+
+
+def tokenize_descriptions(processor, descriptions):
+    """
+    Tokenize all descriptions of a split with a single batched tokenizer call.
+
+    :param processor: CLIP processor
+    :param descriptions: Iterable of description strings
+    :return: Tuple of (input_ids, attention_mask) tensors of shape (N, CACHE_TEXT_LENGTH)
+    """
+    tokens = processor.tokenizer(
+        list(descriptions),
+        padding="max_length",
+        truncation=True,
+        max_length=CACHE_TEXT_LENGTH,
+        return_tensors="pt",
+    )
+    return tokens["input_ids"], tokens["attention_mask"]
+
+
+def collate_dynamic_padding(batch):
+    """
+    DataLoader collate_fn that pads the text only up to the longest description of the batch.
+
+    Samples carry token ids padded to CACHE_TEXT_LENGTH; the padding columns shared by
+    every sample of the batch are cut off, so the text encoder attends over the real
+    sequence length instead of always 77 tokens.
+
+    :param batch: List of samples from SteamDatasetHF
+    :return: Dict of batched tensors (token_ids, attention_mask, pixel_values, desc_ids)
+    """
+    token_ids = torch.stack([sample["token_ids"] for sample in batch])
+    attention_mask = torch.stack([sample["attention_mask"] for sample in batch])
+    max_length = int(attention_mask.sum(dim=1).max())
+
+    return {
+        "token_ids": token_ids[:, :max_length],
+        "attention_mask": attention_mask[:, :max_length],
+        "pixel_values": torch.stack([sample["pixel_values"] for sample in batch]),
+        "desc_ids": torch.tensor([sample["desc_id"] for sample in batch]),
+    }
+
+
+def clip_loss_unique_text(model, token_ids, attention_mask, pixel_values, desc_ids):
+    """
+    CLIP contrastive loss that runs the text encoder once per distinct description.
+
+    Rows sharing a description (e.g. an image and its augmented copies) share the text
+    embedding: only the unique descriptions of the batch go through the text tower and
+    their embeddings are scattered back to the rows. The loss is the same symmetric
+    cross-entropy as CLIPModel.forward(return_loss=True).
+
+    :param model: CLIP model (optionally wrapped by PEFT)
+    :param token_ids: Token ids of the batch (B, L)
+    :param attention_mask: Attention mask of the batch (B, L)
+    :param pixel_values: Pixel values of the batch (B, 3, 224, 224)
+    :param desc_ids: Description id of every row (B,), as returned by the dataset
+    :return: Scalar loss tensor
+    """
+    unique_ids, inverse = torch.unique(desc_ids, return_inverse=True)
+    # One representative row per unique description
+    rows = torch.arange(len(desc_ids), device=desc_ids.device)
+    first_rows = inverse.new_empty(len(unique_ids)).scatter_(0, inverse, rows)
+
+    text_embeds = model.get_text_features(input_ids=token_ids[first_rows], attention_mask=attention_mask[first_rows])
+    image_embeds = model.get_image_features(pixel_values=pixel_values)
+    text_embeds = nn.functional.normalize(text_embeds, dim=-1)[inverse]
+    image_embeds = nn.functional.normalize(image_embeds, dim=-1)
+
+    logits_per_text = model.logit_scale.exp() * text_embeds @ image_embeds.t()
+    labels = torch.arange(len(logits_per_text), device=logits_per_text.device)
+    text_loss = nn.functional.cross_entropy(logits_per_text, labels)
+    image_loss = nn.functional.cross_entropy(logits_per_text.t(), labels)
+    return (text_loss + image_loss) / 2.0
+
+
+def build_gpu_augmentation(processor):
+    """
+    Build the on-the-fly training augmentation as a batched Kornia pipeline.
+
+    It runs on the GPU over whole batches of processor outputs, so pixel values are
+    denormalized to [0, 1] before augmenting and normalized again afterwards.
+
+    :param processor: CLIP processor (provides the normalization mean/std)
+    :return: nn.Module mapping a (B, 3, 224, 224) batch to an augmented batch
+    """
+    # Imported lazily: Kornia is only needed when the opt-in GPU augmentation is enabled
+    import kornia.augmentation as K
+    from kornia.enhance import Denormalize, Normalize
+
+    mean = torch.tensor(processor.image_processor.image_mean)
+    std = torch.tensor(processor.image_processor.image_std)
+    return nn.Sequential(
+        Denormalize(mean=mean, std=std),
+        # Forces model to learn parts of the image, not just the whole
+        K.RandomResizedCrop((224, 224), scale=(0.8, 1.0)),
+        # Randomly flip horizontally (Great for most games)
+        K.RandomHorizontalFlip(p=0.5),
+        # Randomly change brightness/contrast so model doesn't rely on exact colors
+        K.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.1, p=1.0),
+        # (Optional) Random rotation if appropriate for your game UI/style
+        K.RandomRotation(degrees=15.0, p=1.0),
+        Normalize(mean=mean, std=std),
+    )
+
+
+def dataset_worker_init(worker_id):
+    """
+    DataLoader worker_init_fn: give every worker process its own MinIO client.
+
+    boto3 clients are not fork-safe, so instead of sharing the parent's client each
+    worker opens one with a connection pool sized for its prefetch threads.
+
+    :param worker_id: Id of the DataLoader worker (unused)
+    """
+    dataset = get_worker_info().dataset
+    dataset.s3_client = minio_init(
+        config=Config(max_pool_connections=PREFETCH_THREADS, retries={"max_attempts": 3})
+    )
+
+
+def prefetch_to_local(s3_client, csv_data, local_dir, max_workers=32):
+    """
+    Download every image referenced by a split once to a local directory.
+
+    Images are stored as local_dir/<image_path>; files that already exist are skipped,
+    so the same directory can be shared between splits and runs.
+
+    :param s3_client: MinIO S3 client
+    :param csv_data: Either a pandas DataFrame or a CSV string/bytes
+    :param local_dir: Local directory where the images are written
+    :param max_workers: Number of concurrent downloads
+    :return: The local directory
+    """
+    bucket = os.getenv("TRAINING_ZONE_BUCKET")
+    image_keys = load_csv_data(csv_data)["image_path"].unique()
+
+    def download(image_key):
+        local_path = os.path.join(local_dir, image_key)
+        if os.path.exists(local_path):
+            return
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        try:
+            s3_client.download_file(bucket, image_key, local_path)
+        except Exception as e:
+            logging.error(f"Error downloading {image_key}: {e}")
+
+    logging.info(f"Downloading {len(image_keys)} images to {local_dir}...")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(download, image_keys))
+
+    return local_dir
+
+
+def load_image(s3_client, image_key, local_dir=None):
+    """
+    Fetch an image from the training zone, falling back to a black image on errors.
+
+    :param s3_client: MinIO S3 client
+    :param image_key: Key of the image inside the training-zone bucket
+    :param local_dir: Optional directory filled by prefetch_to_local. The image is read
+        from disk when present there, and from MinIO otherwise.
+    :return: RGB PIL image
+    """
+    if local_dir:
+        local_path = os.path.join(local_dir, image_key)
+        if os.path.exists(local_path):
+            try:
+                return Image.open(local_path).convert("RGB")
+            except Exception as e:
+                logging.error(f"Error loading {local_path}, falling back to MinIO: {e}")
+
+    try:
+        resp = s3_client.get_object(Bucket=os.getenv("TRAINING_ZONE_BUCKET"), Key=image_key)
+        img_data = resp["Body"].read()
+        return Image.open(BytesIO(img_data)).convert("RGB")
+    except Exception as e:
+        logging.error(f"Error loading {image_key}: {e}")
+        return Image.new("RGB", (224, 224), color="black")
+
+
+def decode_images_dali(image_paths, processor, batch_size=64):
+    """
+    Decode and pre-process local image files on the GPU with NVIDIA DALI.
+
+    Mirrors the CLIP image processor (bicubic resize of the shortest edge, center crop
+    and normalization) with nvJPEG decoding and a fused crop/normalize kernel, so the
+    CPU no longer decodes and resizes every image.
+
+    :param image_paths: Local image files, in output order
+    :param processor: CLIP processor (provides resize size and normalization mean/std)
+    :param batch_size: Number of images decoded per pipeline run
+    :return: Generator of float16 numpy arrays of shape (batch, *CACHE_IMAGE_SHAPE)
+    """
+    # Imported lazily: DALI is only available on CUDA images
+    from nvidia.dali import fn, pipeline_def, types
+    from nvidia.dali.plugin.pytorch import DALIGenericIterator, LastBatchPolicy
+
+    image_processor = processor.image_processor
+    _, height, width = CACHE_IMAGE_SHAPE
+
+    @pipeline_def(batch_size=batch_size, num_threads=PREFETCH_THREADS, device_id=torch.cuda.current_device())
+    def clip_pipeline():
+        jpegs, _ = fn.readers.file(files=list(image_paths), random_shuffle=False, name="Reader")
+        images = fn.decoders.image(jpegs, device="mixed", output_type=types.RGB)
+        images = fn.resize(images, resize_shorter=image_processor.size["shortest_edge"], interp_type=types.INTERP_CUBIC)
+        return fn.crop_mirror_normalize(
+            images,
+            dtype=types.FLOAT16,
+            output_layout="CHW",
+            crop=(height, width),
+            mean=[m * 255 for m in image_processor.image_mean],
+            std=[s * 255 for s in image_processor.image_std],
+        )
+
+    pipe = clip_pipeline()
+    pipe.build()
+    iterator = DALIGenericIterator(
+        pipe, ["pixel_values"], reader_name="Reader", last_batch_policy=LastBatchPolicy.PARTIAL
+    )
+    for batch in iterator:
+        yield batch[0]["pixel_values"].cpu().numpy()
+
+
+def dali_available():
+    """
+    Check whether NVIDIA DALI can be imported (it is only installable on CUDA hosts).
+
+    :return: True if decode_images_dali can be used
+    """
+    try:
+        import nvidia.dali  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def cache_key(csv_data, processor, use_dali):
+    """
+    Name of the processor cache of a split, derived from everything the cache content depends on.
+
+    Runs over the same split with the same processor settings share the cache instead of
+    rebuilding it, and a changed split or processor never reuses a stale one.
+
+    :param csv_data: Either a pandas DataFrame or a CSV string/bytes
+    :param processor: CLIP processor
+    :param use_dali: Whether the images are pre-processed with DALI
+    :return: Hex digest to use as the cache directory name
+    """
+    digest = hashlib.sha256()
+    digest.update(load_csv_data(csv_data).to_csv(index=False).encode("utf-8"))
+    digest.update(processor.image_processor.to_json_string().encode("utf-8"))
+    digest.update(processor.tokenizer.name_or_path.encode("utf-8"))
+    digest.update(f"{CACHE_IMAGE_SHAPE}{CACHE_TEXT_LENGTH}{use_dali}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def cache_complete(cache_path):
+    """
+    Check whether build_cache finished writing a cache directory.
+
+    :param cache_path: Local directory of the cache
+    :return: True if the cache can be reused as is
+    """
+    return os.path.exists(os.path.join(cache_path, CACHE_COMPLETE_MARKER))
+
+
+def build_cache(s3_client, csv_data, processor, out_path, local_dir=None, use_dali=False, batch_size=64):
+    """
+    Run the CLIP processor once over a split and store its outputs on local disk.
+    A complete cache already present in out_path is reused as is (see cache_key).
+
+    Every image is fetched from MinIO a single time and the processor outputs are
+    written into preallocated memmaps (pixel_values.dat, token_ids.dat and
+    attention_mask.dat), so SteamDatasetHF can serve samples as plain array slices
+    instead of downloading and pre-processing them again every epoch.
+
+    :param s3_client: MinIO S3 client
+    :param csv_data: Either a pandas DataFrame or a CSV string/bytes
+    :param processor: CLIP processor
+    :param out_path: Local directory where the cache files are written
+    :param local_dir: Optional directory filled by prefetch_to_local to read images from
+    :param use_dali: Pre-process the images on the GPU with decode_images_dali. Only used
+        when DALI is installed and every image of the split is present in local_dir.
+    :param batch_size: Number of images pre-processed per processor (or DALI pipeline) call
+    :return: The cache directory
+    """
+    if use_dali and not dali_available():
+        logging.warning("NVIDIA DALI is not installed. Pre-processing the images with the CLIP processor.")
+        use_dali = False
+
+    if cache_complete(out_path):
+        logging.info(f"Reusing processor cache: {out_path}")
+        return out_path
+
+    data = load_csv_data(csv_data)
+    os.makedirs(out_path, exist_ok=True)
+    pixel_values, token_ids, attention_mask = open_cache(out_path, len(data), mode="w+")
+
+    logging.info(f"Building processor cache for {len(data)} rows in {out_path}...")
+    input_ids, mask = tokenize_descriptions(processor, data["description"])
+    token_ids[:] = input_ids.numpy()
+    attention_mask[:] = mask.numpy()
+
+    image_paths = [os.path.join(local_dir, image_key) for image_key in data["image_path"]] if local_dir else []
+    if use_dali and image_paths and all(os.path.exists(path) for path in image_paths):
+        offset = 0
+        for batch in decode_images_dali(image_paths, processor, batch_size=batch_size):
+            pixel_values[offset : offset + len(batch)] = batch
+            offset += len(batch)
+    else:
+        # Same scheme as SteamDatasetHF.__getitems__: the images of a batch are fetched and
+        # decoded in parallel, then pre-processed with a single processor call
+        image_keys = data["image_path"].tolist()
+        with ThreadPoolExecutor(max_workers=PREFETCH_THREADS) as executor:
+            for start in range(0, len(image_keys), batch_size):
+                batch_keys = image_keys[start : start + batch_size]
+                images = list(executor.map(lambda key: load_image(s3_client, key, local_dir), batch_keys))
+                batch = processor.image_processor(images, return_tensors="np")["pixel_values"]
+                pixel_values[start : start + len(batch)] = batch
+
+    for array in (pixel_values, token_ids, attention_mask):
+        array.flush()
+    # Written last, so an interrupted build is never reused
+    open(os.path.join(out_path, CACHE_COMPLETE_MARKER), "w").close()
+
+    logging.info(f"Processor cache ready: {out_path}")
+    return out_path
+
+
 class SteamDatasetHF(Dataset):
-    def __init__(self, s3_client, csv_data, processor):
+    def __init__(self, s3_client, csv_data, processor, cache_path=None, local_dir=None, pixel_dtype=torch.float32):
         """
         Dataset for loading pre-processed images and text from MinIO.
 
@@ -63,47 +451,101 @@ class SteamDatasetHF(Dataset):
         :param s3_client: MinIO S3 client
         :param csv_data: Either a pandas DataFrame or a CSV string/bytes
         :param processor: CLIP processor
+        :param cache_path: Optional directory created by build_cache. When given,
+            samples are read from the memory-mapped cache instead of MinIO.
+        :param local_dir: Optional directory filled by prefetch_to_local. Images are
+            read from it and only fetched from MinIO when missing.
+        :param pixel_dtype: dtype of the returned pixel values. Casting here (instead of
+            after .to(device)) halves the host-to-device copy for fp16/bf16 training.
         """
         self.s3_client = s3_client
+        self.pixel_dtype = pixel_dtype
+        self.local_dir = local_dir
+        self.data = load_csv_data(csv_data)
+        self.processor = processor
 
-        # Accept DataFrame or CSV
-        if isinstance(csv_data, pd.DataFrame):
-            self.data = csv_data
-        elif isinstance(csv_data, (str, bytes)):
-            self.data = pd.read_csv(StringIO(csv_data) if isinstance(csv_data, str) else BytesIO(csv_data))
+        self.cache_path = cache_path
+        if cache_path:
+            self.pixel_values, self.token_ids, self.attention_mask = open_cache(cache_path, len(self.data))
         else:
-            raise ValueError("csv_data must be a pandas DataFrame, string, or bytes")
+            # Tokenize every description once instead of once per sample and epoch
+            self.token_ids, self.attention_mask = tokenize_descriptions(processor, self.data["description"])
 
-        self.processor = processor
+        # Rows with the same description share an id, so the text encoder can run once per description
+        self.desc_ids = pd.factorize(self.data["description"])[0]
+
+        # Thread pool for parallel S3 fetches, created lazily inside each worker process
+        self._executor = None
+
+    def __getstate__(self):
+        # Thread pools cannot be pickled/forked, every DataLoader worker builds its own.
+        # Memmaps are reopened on unpickling instead of being copied into the state.
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        if self.cache_path:
+            for name in ("pixel_values", "token_ids", "attention_mask"):
+                state.pop(name)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.cache_path:
+            self.pixel_values, self.token_ids, self.attention_mask = open_cache(self.cache_path, len(self.data))
 
     def __len__(self):
         return len(self.data)
 
+    def __getitems__(self, indices):
+        """
+        Fetch a whole batch at once (used by the DataLoader when available).
+
+        The S3 requests of the batch are issued in parallel from a thread pool, so the
+        network round-trips overlap instead of adding up sample by sample.
+
+        :param indices: List of row indices of the batch
+        :return: List of samples, as returned by __getitem__
+        """
+        if self.cache_path:
+            return [self[idx] for idx in indices]
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=PREFETCH_THREADS)
+
+        image_keys = self.data["image_path"].iloc[indices]
+        images = list(self._executor.map(lambda key: load_image(self.s3_client, key, self.local_dir), image_keys))
+        pixel_values = self.processor.image_processor(images, return_tensors="pt")["pixel_values"].to(self.pixel_dtype)
+
+        return [
+            {
+                "token_ids": self.token_ids[idx],
+                "attention_mask": self.attention_mask[idx],
+                "pixel_values": pixel_values[i],
+                "desc_id": self.desc_ids[idx],
+            }
+            for i, idx in enumerate(indices)
+        ]
+
     def __getitem__(self, idx):
-        row = self.data.iloc[idx]
-        image_key = row["image_path"]
-        desc = row["description"]
+        if self.cache_path:
+            # Pure array slice: no network access and no processor call
+            return {
+                "token_ids": torch.from_numpy(np.array(self.token_ids[idx])).long(),
+                "attention_mask": torch.from_numpy(np.array(self.attention_mask[idx])).long(),
+                "pixel_values": torch.from_numpy(np.array(self.pixel_values[idx])).to(self.pixel_dtype),
+                "desc_id": self.desc_ids[idx],
+            }
 
         # Fetch image (already pre-processed and augmented if needed)
-        try:
-            resp = self.s3_client.get_object(Bucket=os.getenv("TRAINING_ZONE_BUCKET"), Key=image_key)
-            img_data = resp["Body"].read()
-            image = Image.open(BytesIO(img_data)).convert("RGB")
-        except Exception as e:
-            logging.error(f"Error loading {image_key}: {e}")
-            image = Image.new("RGB", (224, 224), color="black")
-
-        # Processor: tokenizer for text + processor for images
-        # - Tokenize text and return token IDs
-        # - Process images and return pixel values (3,224,224)
-        inputs = self.processor(
-            text=[desc], images=image, return_tensors="pt", padding="max_length", truncation=True
-        )
+        image = load_image(self.s3_client, self.data["image_path"].iloc[idx], self.local_dir)
+
+        # Text is already tokenized, only process the image -> pixel values (3,224,224)
+        inputs = self.processor.image_processor(image, return_tensors="pt")
 
         return {
-            "token_ids": inputs["input_ids"].squeeze(0),
-            "attention_mask": inputs["attention_mask"].squeeze(0),
-            "pixel_values": inputs["pixel_values"].squeeze(0),
+            "token_ids": self.token_ids[idx],
+            "attention_mask": self.attention_mask[idx],
+            "pixel_values": inputs["pixel_values"].squeeze(0).to(self.pixel_dtype),
+            "desc_id": self.desc_ids[idx],
         }
 
 
@@ -113,7 +555,8 @@ class SteamDatasetHF(Dataset):
 # This class is kept for backward compatibility or if wanted to revert
 # to on-the-fly augmentation instead of pre-computed augmented images.
 # To use it, replace SteamDatasetHF with SteamDatasetHF_WithAugmentation
-# in fine_tune.py and pass is_train=True for training data.
+# in fine_tune.py and set "gpu_augmentation" to True in BASE_CONFIG: the
+# augmentation itself runs batched on the GPU (see build_gpu_augmentation).
 # ============================================================================
 
 
@@ -124,69 +567,42 @@ class SteamDatasetHF_WithAugmentation(Dataset):
     Kept here for reference or if you want to revert to on-the-fly augmentation.
     """
 
-    def __init__(self, s3_client, csv_data, processor, is_train=False):
+    def __init__(self, s3_client, csv_data, processor, cache_path=None, local_dir=None, pixel_dtype=torch.float32):
         """
+        Takes the same arguments as SteamDatasetHF, so it can replace it in fine_tune.py.
+        The augmentation itself is applied on the GPU by the training loop, not by the dataset.
+
         :param s3_client: MinIO S3 client
         :param csv_data: Either a pandas DataFrame or a CSV string/bytes
         :param processor: CLIP processor
-        :param is_train: Whether to apply training augmentations on-the-fly
+        :param cache_path: Accepted for compatibility and ignored: images are processed on the fly
+        :param local_dir: Optional directory filled by prefetch_to_local. Images are
+            read from it and only fetched from MinIO when missing.
+        :param pixel_dtype: dtype of the returned pixel values
         """
         self.s3_client = s3_client
-
-        # Accept DataFrame or CSV content
-        if isinstance(csv_data, pd.DataFrame):
-            self.data = csv_data
-        elif isinstance(csv_data, (str, bytes)):
-            self.data = pd.read_csv(StringIO(csv_data) if isinstance(csv_data, str) else BytesIO(csv_data))
-        else:
-            raise ValueError("csv_data must be a pandas DataFrame, string, or bytes")
-
+        self.data = load_csv_data(csv_data)
         self.processor = processor
-        self.is_train = is_train
-
-        # Define Dynamic Transforms (Run on CPU before CLIP Processor)
-        # Only applied when is_train=True
-        self.train_transform = transforms.Compose(
-            [
-                # Forces model to learn parts of the image, not just the whole
-                transforms.RandomResizedCrop(size=224, scale=(0.8, 1.0)),
-                # Randomly flip horizontally (Great for most games)
-                transforms.RandomHorizontalFlip(p=0.5),
-                # Randomly change brightness/contrast so model doesn't rely on exact colors
-                transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.1),
-                # (Optional) Random rotation if appropriate for your game UI/style
-                transforms.RandomRotation(degrees=15),
-            ]
-        )
+        self.local_dir = local_dir
+        self.pixel_dtype = pixel_dtype
+
+        # Tokenize every description once instead of once per sample and epoch
+        self.token_ids, self.attention_mask = tokenize_descriptions(processor, self.data["description"])
+        self.desc_ids = pd.factorize(self.data["description"])[0]
 
     def __len__(self):
         return len(self.data)
 
     def __getitem__(self, idx):
-        row = self.data.iloc[idx]
-        image_key = row["image_path"]
-        desc = row["description"]
-
         # Fetch image
-        try:
-            resp = self.s3_client.get_object(Bucket=os.getenv("TRAINING_ZONE_BUCKET"), Key=image_key)
-            img_data = resp["Body"].read()
-            image = Image.open(BytesIO(img_data)).convert("RGB")
-
-            # Apply augmentation on-the-fly if training
-            if self.is_train:
-                image = self.train_transform(image)
-        except Exception as e:
-            logging.error(f"Error loading {image_key}: {e}")
-            image = Image.new("RGB", (224, 224), color="black")
+        image = load_image(self.s3_client, self.data["image_path"].iloc[idx], self.local_dir)
 
-        # Processor: tokenizer for text + processor for images
-        inputs = self.processor(
-            text=[desc], images=image, return_tensors="pt", padding="max_length", truncation=True
-        )
+        # Text is already tokenized, only process the image
+        inputs = self.processor.image_processor(image, return_tensors="pt")
 
         return {
-            "token_ids": inputs["input_ids"].squeeze(0),
-            "attention_mask": inputs["attention_mask"].squeeze(0),
-            "pixel_values": inputs["pixel_values"].squeeze(0),
+            "token_ids": self.token_ids[idx],
+            "attention_mask": self.attention_mask[idx],
+            "pixel_values": inputs["pixel_values"].squeeze(0).to(self.pixel_dtype),
+            "desc_id": self.desc_ids[idx],
         }
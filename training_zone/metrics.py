@@ -9,6 +9,25 @@ import numpy as np
 import torch
 
 
+def hit_positions(sorted_indices, correct_t):
+    """
+    Position (1-indexed) of the correct item of every query in its sorted item indices.
+
+    Shared by Recall@K, mAP@K and compute_all_metrics, so every K is derived from a
+    single comparison pass.
+
+    Args:
+        sorted_indices: Tensor of shape (n_queries, n) with sorted item indices (descending by similarity)
+        correct_t: Tensor of shape (n_queries, 1) with the correct item index of each query
+
+    Returns:
+        Float tensor of shape (n_queries,); n + 1 where the correct item is not among the n indices
+    """
+    matches = sorted_indices == correct_t
+    n = sorted_indices.shape[1]
+    return torch.where(matches.any(dim=1), matches.int().argmax(dim=1) + 1, n + 1).float()
+
+
 def recall_at_k(sorted_indices, correct_indices, k):
     """
     Calculate Recall@K for 1-to-1 image-text retrieval.
@@ -18,24 +37,18 @@ def recall_at_k(sorted_indices, correct_indices, k):
 
     Args:
         sorted_indices: Tensor of shape (n_queries, n_items) with sorted item indices (descending by similarity)
-        correct_indices: List/array of correct item indices for each query (one per query)
+        correct_indices: List/array/tensor of correct item indices for each query (one per query)
         k: Top-K items to consider
 
     Returns:
         float: Recall@K score (proportion of queries where correct item was in top-K)
     """
-    n_queries = sorted_indices.shape[0]
-    recall_count = 0
+    correct = torch.as_tensor(correct_indices, device=sorted_indices.device, dtype=sorted_indices.dtype).view(-1, 1)
 
-    for i in range(n_queries):
-        # Get top-k indices for this query (already sorted)
-        top_k_indices = sorted_indices[i, :k]
+    # Check for all queries at once if the correct index is in the top-k (binary: either found or not)
+    hits = hit_positions(sorted_indices[:, :k], correct) <= k
 
-        # Check if correct index is in top-k (binary: either found or not)
-        if correct_indices[i] in top_k_indices:
-            recall_count += 1
-
-    return recall_count / n_queries
+    return hits.float().mean().item()
 
 
 def mean_average_precision_at_k(sorted_indices, correct_indices, k):
@@ -50,30 +63,22 @@ def mean_average_precision_at_k(sorted_indices, correct_indices, k):
 
     Args:
         sorted_indices: Tensor of shape (n_queries, n_items) with sorted item indices (descending by similarity)
-        correct_indices: List/array of correct item indices for each query (one per query)
+        correct_indices: List/array/tensor of correct item indices for each query (one per query)
         k: Top-K items to consider
 
     Returns:
         float: mAP@K score
     """
-    n_queries = sorted_indices.shape[0]
-    average_precisions = []
+    correct = torch.as_tensor(correct_indices, device=sorted_indices.device, dtype=sorted_indices.dtype).view(-1, 1)
 
-    for i in range(n_queries):
-        # Get top-k indices for this query (already sorted)
-        top_k_indices = sorted_indices[i, :k]
+    # Position of correct item in top-k (1-indexed), k + 1 when not found
+    positions = hit_positions(sorted_indices[:, :k], correct)
 
-        # Find position of correct item in top-k (1-indexed)
-        correct_idx = correct_indices[i]
-        if correct_idx in top_k_indices:
-            position = (top_k_indices == correct_idx).nonzero(as_tuple=True)[0].item() + 1
-            # Average Precision for single relevant item = 1/position
-            # e.g., rank 1 = 1.0, rank 2 = 0.5, rank 5 = 0.2
-            average_precisions.append(1.0 / position)
-        else:
-            average_precisions.append(0.0)
+    # Average Precision for single relevant item = 1/position, 0 if not in top-k
+    # e.g., rank 1 = 1.0, rank 2 = 0.5, rank 5 = 0.2
+    average_precisions = torch.where(positions <= k, 1.0 / positions, 0.0)
 
-    return np.mean(average_precisions)
+    return average_precisions.mean().item()
 
 
 def mean_reciprocal_rank(sorted_indices, correct_indices):
@@ -87,21 +92,83 @@ def mean_reciprocal_rank(sorted_indices, correct_indices):
 
     Args:
         sorted_indices: Tensor of shape (n_queries, n_items) with sorted item indices (descending by similarity)
-        correct_indices: List/array of correct item indices for each query (one per query)
+        correct_indices: List/array/tensor of correct item indices for each query (one per query)
 
     Returns:
         float: MRR score
     """
-    n_queries = sorted_indices.shape[0]
-    reciprocal_ranks = []
+    correct = torch.as_tensor(correct_indices, device=sorted_indices.device, dtype=sorted_indices.dtype).view(-1, 1)
+
+    # Position of correct item (1-indexed) for all queries at once - already sorted
+    positions = (sorted_indices == correct).int().argmax(dim=1) + 1
+
+    return (1.0 / positions.float()).mean().item()
+
+
+def reciprocal_ranks(similarities, correct_t):
+    """
+    Reciprocal rank of the correct item of every query, computed without sorting.
+
+    The rank is the number of items whose similarity is greater than or equal to the
+    similarity of the correct item (the correct item included). Ties are broken
+    pessimistically: items scoring the same as the correct one are ranked ahead of it,
+    so a degenerate model giving every item the same score gets no credit for ties.
+
+    Args:
+        similarities: Tensor of shape (n_queries, n_items) with similarity scores
+        correct_t: int64 tensor of shape (n_queries, 1) with the correct item index of each query
+
+    Returns:
+        Tensor of shape (n_queries,) with 1/rank per query
+    """
+    correct_scores = similarities.gather(1, correct_t)
+    ranks = (similarities >= correct_scores).sum(dim=1)
+    return 1.0 / ranks.float()
 
-    for i in range(n_queries):
-        # Find position of correct item (1-indexed) - already sorted
-        correct_idx = correct_indices[i]
-        position = (sorted_indices[i] == correct_idx).nonzero(as_tuple=True)[0].item() + 1
-        reciprocal_ranks.append(1.0 / position)
 
-    return np.mean(reciprocal_ranks)
+def mean_reciprocal_rank_from_similarities(similarities, correct_indices):
+    """
+    Calculate Mean Reciprocal Rank (MRR) from the similarity scores, without sorting.
+
+    Same metric as mean_reciprocal_rank, with ties broken pessimistically (see reciprocal_ranks).
+
+    Args:
+        similarities: Tensor of shape (n_queries, n_items) with similarity scores
+        correct_indices: List/array/tensor of correct item indices for each query (one per query)
+
+    Returns:
+        float: MRR score
+    """
+    correct = torch.as_tensor(correct_indices, device=similarities.device, dtype=torch.long).view(-1, 1)
+    return reciprocal_ranks(similarities, correct).mean().item()
+
+
+def top_k_indices(similarities, k):
+    """
+    Indices of the top-K items per query, in descending order of similarity.
+
+    For K=1 this is an argmax. Otherwise, on CPU, NumPy's argpartition selects the K best
+    items in O(n_items) per row and only those K are sorted; on other devices torch.topk
+    is used.
+
+    Args:
+        similarities: Tensor of shape (n_queries, n_items) with similarity scores
+        k: Number of items to keep (at most n_items)
+
+    Returns:
+        Tensor of shape (n_queries, k) with item indices, on the device of similarities
+    """
+    if k == 1:
+        # A single linear reduction, no selection needed
+        return similarities.argmax(dim=1, keepdim=True)
+
+    if similarities.device.type != "cpu":
+        return torch.topk(similarities, k=k, dim=1, sorted=True).indices
+
+    sim = similarities.detach().float().numpy()
+    candidates = np.argpartition(-sim, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(sim, candidates, axis=1), axis=1)
+    return torch.from_numpy(np.take_along_axis(candidates, order, axis=1))
 
 
 def compute_all_metrics(similarities, correct_indices, k_values=[1, 5, 10]):
@@ -116,26 +183,45 @@ def compute_all_metrics(similarities, correct_indices, k_values=[1, 5, 10]):
 
     Args:
         similarities: Tensor of shape (n_queries, n_items) with similarity scores
-        correct_indices: List/array of correct item indices for each query (one per query)
+        correct_indices: List/array/tensor of correct item indices for each query (one per query)
         k_values: List of K values for Recall@K and mAP@K
 
     Returns:
         dict: Dictionary containing all computed metrics
     """
-    # Sort once: get indices sorted by similarity (descending)
-    sorted_indices = torch.argsort(similarities, dim=1, descending=True)
+    # Select once: only the top max(K) items are needed (partial selection instead of a full sort).
+    # The top-K stays in descending order, which mAP@K relies on for positions
+    max_k = min(max(k_values), similarities.shape[1])
+    top_indices = top_k_indices(similarities, max_k)
+
+    # Convert the correct indices to a device tensor once, shared by every metric and K
+    # (int64, the dtype of both the top-K indices and gather's index argument)
+    correct_t = torch.as_tensor(correct_indices, device=similarities.device, dtype=torch.long).view(-1, 1)
+
+    # Position (1-indexed) of the correct item in the top-max(K), computed once for every K.
+    # Queries whose correct item is not in the top-max(K) get max_k + 1
+    positions = hit_positions(top_indices, correct_t)
+
+    # Cumulative hit mask for every K at once (n_queries, len(k_values)):
+    # True where the correct item lies within the first K positions
+    ks = torch.as_tensor(k_values, device=positions.device)
+    within = positions.view(-1, 1) <= ks
+    reciprocal = (1.0 / positions).view(-1, 1)
+
+    values = {}
 
-    metrics = {}
+    # Recall@K: correct item within the first K positions (as recall_at_k)
+    for k, recall in zip(k_values, within.float().mean(dim=0)):
+        values[f"recall@{k}"] = recall
 
-    # Compute Recall@K for each K (using pre-sorted indices)
-    for k in k_values:
-        metrics[f"recall@{k}"] = recall_at_k(sorted_indices, correct_indices, k)
+    # mAP@K: 1/position when within the first K positions, 0 otherwise (as mean_average_precision_at_k)
+    for k, average_precision in zip(k_values, (within * reciprocal).mean(dim=0)):
+        values[f"map@{k}"] = average_precision
 
-    # Compute mAP@K for each K (using pre-sorted indices)
-    for k in k_values:
-        metrics[f"map@{k}"] = mean_average_precision_at_k(sorted_indices, correct_indices, k)
+    # MRR (rank counting, no sort needed; ties broken pessimistically)
+    values["mrr"] = reciprocal_ranks(similarities, correct_t).mean()
 
-    # Compute MRR (using pre-sorted indices)
-    metrics["mrr"] = mean_reciprocal_rank(sorted_indices, correct_indices)
+    # A single device-to-host transfer for all the metrics
+    metrics = dict(zip(values, torch.stack(list(values.values())).tolist()))
 
     return metrics
@@ -0,0 +1,78 @@
+"""
+Helpers to fetch the trained models stored in the training zone of MinIO.
+"""
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.s3.transfer import TransferConfig
+
+# Multipart, multi-threaded downloads for the model weight files
+MODEL_TRANSFER_CONFIG = TransferConfig(multipart_threshold=8 * 1024 * 1024, max_concurrency=8)
+
+# Model files downloaded at once: with the 8 parts in flight per file this fills the
+# 64 pooled connections of minio_init's client without queuing on the pool
+MODEL_DOWNLOAD_WORKERS = 8
+
+
+def list_objects(s3_client, bucket, prefix, delimiter=None):
+    """
+    List every object under a prefix, following pagination (list_objects_v2 returns at
+    most 1000 keys per call).
+
+    :param s3_client: MinIO S3 client
+    :param bucket: Bucket name
+    :param prefix: Key prefix
+    :param delimiter: Optional delimiter, to group keys into common prefixes
+    :return: Tuple of (list of object dicts, list of common prefixes)
+    """
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    if delimiter:
+        kwargs["Delimiter"] = delimiter
+
+    contents, prefixes = [], []
+    for page in s3_client.get_paginator("list_objects_v2").paginate(**kwargs):
+        contents.extend(page.get("Contents", []))
+        prefixes.extend(p["Prefix"] for p in page.get("CommonPrefixes", []))
+    return contents, prefixes
+
+
+def download_latest_model(s3_client, bucket, technique_prefix, local_dir):
+    """
+    Download the most recent model saved under a technique prefix to a local directory.
+
+    Model directories are named after their training timestamp (YYYYMMDD_HHMMSS_...), so
+    the most recent one is the largest name. Its files are downloaded concurrently, and
+    the large weight files in parallel multipart ranges.
+
+    :param s3_client: MinIO S3 client (see minio_init)
+    :param bucket: Bucket name
+    :param technique_prefix: Prefix of the technique's models (e.g. "models/fp16/")
+    :param local_dir: Local directory receiving the model files
+    :return: Key prefix of the downloaded model
+    """
+    _, prefixes = list_objects(s3_client, bucket, technique_prefix, delimiter="/")
+    if not prefixes:
+        raise FileNotFoundError(f"No trained model found in bucket '{bucket}/{technique_prefix}'")
+
+    # Most recent by timestamp, a single pass instead of a sort
+    model_path = max(prefix.rstrip("/") for prefix in prefixes)
+    logging.info(f"Loading model from {bucket}/{model_path}...")
+
+    objects, _ = list_objects(s3_client, bucket, model_path)
+
+    def download(key):
+        # Get relative path from model_path
+        relative_path = key[len(model_path) :].lstrip("/")
+        if not relative_path:
+            return
+
+        local_file_path = os.path.join(local_dir, relative_path)
+        os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
+        s3_client.download_file(bucket, key, local_file_path, Config=MODEL_TRANSFER_CONFIG)
+
+    with ThreadPoolExecutor(max_workers=MODEL_DOWNLOAD_WORKERS) as executor:
+        list(executor.map(download, [obj["Key"] for obj in objects]))
+
+    return model_path
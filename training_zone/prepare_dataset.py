@@ -1,12 +1,15 @@
-import json
 import logging
 import os
 import random
+import tempfile
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
 import boto3
+import orjson
 import pandas as pd
+from botocore.config import Config
 from dotenv import find_dotenv, load_dotenv
 from global_scripts.utils import create_bucket, delete_items
 from PIL import Image
@@ -19,6 +22,62 @@ logging.basicConfig(
     force=True,
 )
 
+# Concurrent image copies (I/O-bound: each one waits on a MinIO download and upload)
+COPY_WORKERS = 32
+
+# Local cache of downloaded JSON files and resized images, reused by later runs
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "prepare_dataset_cache")
+
+
+def cache_file(source_key, etag):
+    """
+    Path of the local cache entry of a source object.
+
+    The entry is keyed by the object's ETag, so a changed source object never hits a
+    stale entry.
+
+    :param source_key: Key of the object in the exploitation-zone
+    :param etag: ETag of the object, as returned by list_objects_v2
+    :return: Path inside CACHE_DIR
+    """
+    filename = source_key.split("/")[-1]
+    etag = etag.strip('"')
+    return os.path.join(CACHE_DIR, f"{etag}_{filename}")
+
+
+def write_cache(path, data):
+    """
+    Atomically write a cache entry (concurrent writers never expose partial files).
+
+    :param path: Path returned by cache_file
+    :param data: Bytes to store
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{id(data)}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def load_json(s3_client, bucket, key, etag):
+    """
+    Load and parse a JSON object, reading it from the local cache when unchanged.
+
+    :param s3_client: MinIO S3 client
+    :param bucket: Source bucket
+    :param key: Key of the JSON object
+    :param etag: ETag of the object, as returned by list_objects_v2
+    :return: Parsed JSON content
+    """
+    path = cache_file(key, etag)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+
+    body = s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+    write_cache(path, body)
+    return orjson.loads(body)
+
 
 def prepare_dataset(s3_client):
     """
@@ -45,13 +104,19 @@ def prepare_dataset(s3_client):
     # Step 1: Load descriptions from JSON in exploitation-zone
     logging.info("Loading descriptions from exploitation-zone...")
     objs = s3_client.list_objects_v2(Bucket=exploitation_bucket, Prefix="json/")
+    json_etags = {obj["Key"]: obj["ETag"] for obj in objs.get("Contents", []) if obj["Key"].endswith(".json")}
+    json_keys = list(json_etags)
     game_descriptions = {}
 
-    for obj in objs.get("Contents", []):
-        if obj["Key"].endswith(".json"):
-            data = s3_client.get_object(Bucket=exploitation_bucket, Key=obj["Key"])
-            content = json.loads(data["Body"].read().decode("utf-8"))
+    # Fetch and parse all JSON files concurrently (orjson parses the raw bytes directly);
+    # files unchanged since the last run are read from the local cache
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        contents = executor.map(
+            lambda key: load_json(s3_client, exploitation_bucket, key, json_etags[key]),
+            json_keys,
+        )
 
+        for content in contents:
             # Iterate over the games
             for game_id, data in content.items():
                 desc = data["final_description"]
@@ -62,19 +127,19 @@ def prepare_dataset(s3_client):
 
     logging.info(f"Found descriptions for {len(game_descriptions)} games.")
 
-    # Step 2: Copy JSON files to training-zone
+    # Step 2: Copy JSON files to training-zone (server-side copies, issued concurrently)
     logging.info("Copying JSON files to training-zone...")
-    for obj in objs.get("Contents", []):
-        if obj["Key"].endswith(".json"):
-            source_key = obj["Key"]
-            filename = source_key.split("/")[-1]
-            target_key = f"json/{filename}"
-
-            s3_client.copy_object(
-                Bucket=training_bucket,
-                CopySource={"Bucket": exploitation_bucket, "Key": source_key},
-                Key=target_key,
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(
+            executor.map(
+                lambda source_key: s3_client.copy_object(
+                    Bucket=training_bucket,
+                    CopySource={"Bucket": exploitation_bucket, "Key": source_key},
+                    Key=f"json/{source_key.split('/')[-1]}",
+                ),
+                json_keys,
             )
+        )
     logging.info("JSON files copied to training-zone.")
 
     # Step 3: Load original images from exploitation-zone (only non-augmented)
@@ -83,25 +148,26 @@ def prepare_dataset(s3_client):
 
     # Group images by game_id
     images_per_game = defaultdict(list)
+    image_etags = {}
 
     for obj in objs.get("Contents", []):
         key = obj["Key"]
+        image_etags[key] = obj["ETag"]
         filename = key.split("/")[-1]
 
-        # Extract game_id from filename (format: timestamp#game_id#number.jpg)
-        parts = filename.split("#")
-        if len(parts) >= 3:
-            game_id = parts[1]
+        # Extract game_id from filename (format: timestamp#game_id#number.jpg), stopping
+        # at the second separator instead of splitting the whole name
+        _, sep, rest = filename.partition("#")
+        game_id, sep_end, _ = rest.partition("#")
+        if sep and sep_end:
             if game_id in game_descriptions:
                 images_per_game[game_id].append(key)
 
     logging.info(f"Found images for {len(images_per_game)} games.")
 
     # Step 4: For each game, randomly select images for train/val/test
-    random.seed(42)  
-    train_data = []
-    val_data = []
-    test_data = []
+    rng = random.Random(42)  # Local generator: same sequence as seeding the global one
+    tasks = []  # (split, image key, description, game_id)
 
     logging.info("Selecting and copying images for each split...")
 
@@ -112,7 +178,7 @@ def prepare_dataset(s3_client):
 
         # Shuffle and select
         shuffled_images = image_keys.copy()
-        random.shuffle(shuffled_images)
+        rng.shuffle(shuffled_images)
 
         train_images = shuffled_images[:3]  # First 3 for training
         val_images = shuffled_images[3:4]  # 4th for validation
@@ -120,26 +186,27 @@ def prepare_dataset(s3_client):
 
         description = game_descriptions[game_id]
 
-        # Process and copy train images
-        for img_key in train_images:
-            # Download, resize, and upload to training-zone
-            target_key = copy_and_resize_image(s3_client, exploitation_bucket, training_bucket, img_key)
-            train_data.append({"image_path": target_key, "description": description, "game_id": game_id})
-
-        # Process and copy validation image
-        for img_key in val_images:
-            target_key = copy_and_resize_image(s3_client, exploitation_bucket, training_bucket, img_key)
-            val_data.append({"image_path": target_key, "description": description, "game_id": game_id})
-
-        # Process and copy test image
-        for img_key in test_images:
-            target_key = copy_and_resize_image(s3_client, exploitation_bucket, training_bucket, img_key)
-            test_data.append({"image_path": target_key, "description": description, "game_id": game_id})
+        for split_name, split_images in (("train", train_images), ("val", val_images), ("test", test_images)):
+            for img_key in split_images:
+                tasks.append((split_name, img_key, description, game_id))
+
+    # Download, resize, and upload to training-zone, overlapping the network round-trips
+    with ThreadPoolExecutor(max_workers=COPY_WORKERS) as executor:
+        target_keys = list(
+            executor.map(
+                lambda task: copy_and_resize_image(
+                    s3_client, exploitation_bucket, training_bucket, task[1], etag=image_etags[task[1]]
+                ),
+                tasks,
+            )
+        )
 
-    # Create DataFrames
-    train_df = pd.DataFrame(train_data)
-    val_df = pd.DataFrame(val_data)
-    test_df = pd.DataFrame(test_data)
+    # Create DataFrames: one frame with a split column, partitioned in a single groupby pass
+    df = pd.DataFrame(tasks, columns=["split", "source_key", "description", "game_id"])
+    df["image_path"] = target_keys
+    columns = ["image_path", "description", "game_id"]
+    splits = {name: group[columns].reset_index(drop=True) for name, group in df.groupby("split", sort=False)}
+    train_df, val_df, test_df = (splits.get(name, pd.DataFrame(columns=columns)) for name in ("train", "val", "test"))
 
     logging.info("Dataset splits created:")
     logging.info(f"  Train: {len(train_df)} images ({len(train_df['game_id'].unique())} games x 3 images)")
@@ -149,9 +216,12 @@ def prepare_dataset(s3_client):
     # Save splits to MinIO
     logging.info("Saving splits to MinIO...")
     for split_name, split_df in zip(["train", "val", "test"], [train_df, val_df, test_df]):
-        csv_obj = split_df.to_csv(index=False)
+        # Encode straight into a byte buffer instead of building the CSV string first
+        csv_buffer = BytesIO()
+        split_df.to_csv(csv_buffer, index=False, encoding="utf-8")
+        csv_buffer.seek(0)
         try:
-            s3_client.put_object(Bucket=training_bucket, Key=f"data_splits/{split_name}.csv", Body=csv_obj)
+            s3_client.upload_fileobj(csv_buffer, training_bucket, f"data_splits/{split_name}.csv")
             logging.info(f"Saved {split_name}.csv with {len(split_df)} records.")
         except Exception:
             logging.exception(f"Error saving {split_name} split to MinIO.")
@@ -159,30 +229,53 @@ def prepare_dataset(s3_client):
     logging.info("Dataset preparation completed successfully!")
 
 
-def copy_and_resize_image(s3_client, source_bucket, target_bucket, source_key):
+def copy_and_resize_image(s3_client, source_bucket, target_bucket, source_key, etag=None):
     """
     Copy an image from source bucket to target bucket, resizing it to 224x224.
 
+    When the ETag is given, the 224x224 JPEG is kept in the local cache, and later runs
+    upload it directly without downloading, decoding or resizing the source again.
+
     Returns:
         str: The target key in training-zone
     """
+    filename = source_key.split("/")[-1]
+    target_key = f"image/{filename}"
+
+    cached_path = cache_file(source_key, etag) if etag else None
+    if cached_path and os.path.exists(cached_path):
+        s3_client.upload_file(cached_path, target_bucket, target_key)
+        return target_key
+
     # Download image
     resp = s3_client.get_object(Bucket=source_bucket, Key=source_key)
     img_data = resp["Body"].read()
 
-    # Resize to 224x224 (CLIP requirements)
-    pil_img = Image.open(BytesIO(img_data)).convert("RGB")
-    pil_img = pil_img.resize((224, 224), Image.Resampling.LANCZOS)
+    # Opening only reads the header: images already at the target size are copied server-side
+    pil_img = Image.open(BytesIO(img_data))
+    if pil_img.size == (224, 224) and pil_img.format == "JPEG" and pil_img.mode == "RGB":
+        s3_client.copy_object(
+            Bucket=target_bucket, CopySource={"Bucket": source_bucket, "Key": source_key}, Key=target_key
+        )
+        if cached_path:
+            write_cache(cached_path, img_data)
+        return target_key
+
+    # Large JPEGs are decoded directly at a reduced DCT scale that keeps both sides >= 224
+    if pil_img.format == "JPEG":
+        pil_img.draft("RGB", (224, 224))
+
+    # Resize to 224x224 (CLIP requirements, bicubic like the CLIP processor)
+    pil_img = pil_img.convert("RGB").resize((224, 224), Image.Resampling.BICUBIC)
 
     # Save to buffer
     img_buffer = BytesIO()
-    pil_img.save(img_buffer, format="JPEG")
+    pil_img.save(img_buffer, format="JPEG", quality=85, optimize=False)
+    if cached_path:
+        write_cache(cached_path, img_buffer.getvalue())
     img_buffer.seek(0)
 
     # Upload to training-zone with simplified path
-    filename = source_key.split("/")[-1]
-    target_key = f"image/{filename}"
-
     s3_client.upload_fileobj(img_buffer, target_bucket, target_key)
 
     return target_key
@@ -196,6 +289,8 @@ if __name__ == "__main__":
             endpoint_url=os.getenv("ENDPOINT_URL"),
             aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
             aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+            # Enough pooled connections for the copy threads not to queue on the HTTP pool
+            config=Config(max_pool_connections=2 * COPY_WORKERS),
         )
         logging.info("Connected to MinIO.")
     except Exception:
@@ -10,17 +10,21 @@ This script:
 6. Saves results for visualization
 """
 
+import hashlib
 import json
 import logging
 import os
 import tempfile
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
-import boto3
 import numpy as np
 import torch
+from device_utils import to_device
 from dotenv import find_dotenv, load_dotenv
+from global_scripts.utils import minio_init
+from model_store import download_latest_model, list_objects
 from peft import PeftModel
 from PIL import Image
 from tqdm import tqdm
@@ -34,6 +38,9 @@ logging.basicConfig(
     force=True,
 )
 
+# Concurrent S3 downloads (I/O-bound, boto3 releases the GIL while waiting on sockets)
+DOWNLOAD_WORKERS = 32
+
 
 def load_model_from_minio(s3_client, technique, device):
     """
@@ -46,9 +53,14 @@ def load_model_from_minio(s3_client, technique, device):
     """
     bucket = os.getenv("TRAINING_ZONE_BUCKET", "training-zone")
 
+    # Inference only: half precision on GPU halves the weight and activation traffic
+    dtype = torch.float16 if device == "cuda" else torch.float32
+
     if technique.lower() == "baseline":
         logging.info("Loading baseline model (openai/clip-vit-base-patch32)...")
-        model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32").to(device)
+        model = CLIPModel.from_pretrained(
+            "openai/clip-vit-base-patch32", torch_dtype=dtype, low_cpu_mem_usage=True
+        ).to(device)
         processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
         return model, processor
 
@@ -57,45 +69,9 @@ def load_model_from_minio(s3_client, technique, device):
         logging.error(f"Unknown technique '{technique}'. Defaulting to 'fp32'.")
         pattern = "fp32"
 
-    # List all models with this technique and get the most recent one
-    technique_prefix = f"models/{pattern}/"
-    response = s3_client.list_objects_v2(Bucket=bucket, Prefix=technique_prefix, Delimiter="/")
-    matching_dirs = []
-
-    for prefix in response.get("CommonPrefixes", []):
-        dir_name = prefix["Prefix"].rstrip("/")
-        matching_dirs.append(dir_name)
-
-    if not matching_dirs:
-        raise FileNotFoundError(
-            f"No trained model found for technique '{technique}' in bucket '{bucket}/{technique_prefix}'"
-        )
-
-    # Sort by timestamp (assuming format: YYYYMMDD_HHMMSS_...)
-    matching_dirs.sort(reverse=True)
-    latest_model_dir = matching_dirs[0]
-    minio_path = f"{latest_model_dir}"
-
-    logging.info(f"Loading model from {bucket}/{minio_path}...")
-
     with tempfile.TemporaryDirectory() as temp_dir:
-        # List all objects in the minio_path
-        response = s3_client.list_objects_v2(Bucket=bucket, Prefix=minio_path)
-
-        for obj in response.get("Contents", []):
-            key = obj["Key"]
-            # Get relative path from minio_path
-            relative_path = key[len(minio_path) :].lstrip("/")
-            if not relative_path:
-                continue
-
-            local_file_path = os.path.join(temp_dir, relative_path)
-            os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
-
-            # Download file
-            file_response = s3_client.get_object(Bucket=bucket, Key=key)
-            with open(local_file_path, "wb") as f:
-                f.write(file_response["Body"].read())
+        # Most recent model of the technique (weights, configs and processor files)
+        download_latest_model(s3_client, bucket, f"models/{pattern}/", temp_dir)
 
         # Load model and processor from temporary directory
         adapter_config_path = os.path.join(temp_dir, "adapter_config.json")
@@ -103,17 +79,47 @@ def load_model_from_minio(s3_client, technique, device):
         if os.path.exists(adapter_config_path):
             # It's a PEFT model - load base model first, then apply PEFT
             logging.info("Detected PEFT model (LoRA/QLoRA), loading with PEFT...")
-            base_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-            model = PeftModel.from_pretrained(base_model, temp_dir).to(device)
+            base_model = CLIPModel.from_pretrained(
+                "openai/clip-vit-base-patch32", torch_dtype=dtype, low_cpu_mem_usage=True
+            )
+            model = PeftModel.from_pretrained(base_model, temp_dir, torch_dtype=dtype).to(device)
         else:
             # Regular fine-tuned model
-            model = CLIPModel.from_pretrained(temp_dir).to(device)
+            model = CLIPModel.from_pretrained(temp_dir, torch_dtype=dtype, low_cpu_mem_usage=True).to(device)
 
         processor = CLIPProcessor.from_pretrained(temp_dir)
 
         return model, processor
 
 
+def compile_for_inference(model, device, images_per_batch=5):
+    """
+    Compile the embedding functions of a model with torch.compile (CUDA only).
+
+    The "reduce-overhead" mode captures CUDA graphs, which pays off because the same
+    input shapes are used for every game. A dummy forward at the image batch shape
+    triggers the compilation before the timed loops.
+
+    :param model: CLIP model (optionally wrapped by PEFT), already on the device
+    :param device: The device the model is on
+    :param images_per_batch: Number of images per get_image_features call
+    :return: The same model, with compiled get_image_features/get_text_features
+    """
+    if device != "cuda":
+        return model
+
+    model.eval()
+    model.get_image_features = torch.compile(model.get_image_features, mode="reduce-overhead", fullgraph=False)
+    model.get_text_features = torch.compile(model.get_text_features, mode="reduce-overhead", fullgraph=False)
+
+    # Warm up at the shape used for every game
+    with torch.no_grad():
+        dtype = next(model.parameters()).dtype
+        model.get_image_features(pixel_values=torch.zeros(images_per_batch, 3, 224, 224, dtype=dtype, device=device))
+
+    return model
+
+
 def load_all_games_data(s3_client):
     """
     Load ALL games (100) with their images and descriptions from exploitation-zone.
@@ -123,16 +129,23 @@ def load_all_games_data(s3_client):
     """
     exploitation_bucket = os.getenv("EXPLOITATION_ZONE_BUCKET")
 
+    # List the descriptions and the images concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        json_listing, image_listing = executor.map(
+            lambda prefix: list_objects(s3_client, exploitation_bucket, prefix)[0], ["json/", "media/image/"]
+        )
+
     # Load descriptions
     logging.info("Loading descriptions from exploitation-zone...")
     game_descriptions = {}
-    objs = s3_client.list_objects_v2(Bucket=exploitation_bucket, Prefix="json/")
+    json_keys = [obj["Key"] for obj in json_listing if obj["Key"].endswith(".json")]
 
-    for obj in objs.get("Contents", []):
-        if obj["Key"].endswith(".json"):
-            data = s3_client.get_object(Bucket=exploitation_bucket, Key=obj["Key"])
-            content = json.loads(data["Body"].read().decode("utf-8"))
+    def fetch_json(key):
+        data = s3_client.get_object(Bucket=exploitation_bucket, Key=key)
+        return json.loads(data["Body"].read().decode("utf-8"))
 
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        for content in executor.map(fetch_json, json_keys):
             for game_id, data in content.items():
                 desc = data.get("final_description")
                 if desc:
@@ -144,9 +157,9 @@ def load_all_games_data(s3_client):
     logging.info("Loading images from exploitation-zone...")
     games_data = defaultdict(lambda: {"description": "", "images": [], "image_keys": []})
 
-    objs = s3_client.list_objects_v2(Bucket=exploitation_bucket, Prefix="media/image/")
+    image_tasks = []  # (game_id, key)
 
-    for obj in objs.get("Contents", []):
+    for obj in image_listing:
         key = obj["Key"]
         filename = key.split("/")[-1]
 
@@ -156,17 +169,26 @@ def load_all_games_data(s3_client):
             game_id = parts[1]
 
             if game_id in game_descriptions:
-                # Download image
-                try:
-                    resp = s3_client.get_object(Bucket=exploitation_bucket, Key=key)
-                    img_data = resp["Body"].read()
-                    image = Image.open(BytesIO(img_data)).convert("RGB")
-
-                    games_data[game_id]["images"].append(image)
-                    games_data[game_id]["image_keys"].append(key)
-                    games_data[game_id]["description"] = game_descriptions[game_id]
-                except Exception as e:
-                    logging.error(f"Error loading image {key}: {e}")
+                image_tasks.append((game_id, key))
+
+    def fetch_image(task):
+        # Download and decode image (PIL releases the GIL while decoding)
+        _, key = task
+        try:
+            resp = s3_client.get_object(Bucket=exploitation_bucket, Key=key)
+            img_data = resp["Body"].read()
+            return Image.open(BytesIO(img_data)).convert("RGB")
+        except Exception as e:
+            logging.error(f"Error loading image {key}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        for (game_id, key), image in zip(image_tasks, executor.map(fetch_image, image_tasks)):
+            if image is None:
+                continue
+            games_data[game_id]["images"].append(image)
+            games_data[game_id]["image_keys"].append(key)
+            games_data[game_id]["description"] = game_descriptions[game_id]
 
     # Filter games with exactly 5 images
     valid_games = {gid: data for gid, data in games_data.items() if len(data["images"]) == 5}
@@ -176,41 +198,103 @@ def load_all_games_data(s3_client):
     return valid_games
 
 
-def compute_embeddings_for_all_games(model, processor, games_data, device):
+def preprocess_all(games_data, processor, device, text_batch_size=32):
     """
-    Compute embeddings for all images and texts for all games.
-
-    Returns:
-        dict: {game_id: {"image_embeddings": tensor[5, dim], "text_embedding": tensor[1, dim]}}
+    Preprocess the images and descriptions of all games once, shared by every model.
+
+    Both models are fine-tuned from the same CLIP checkpoint, so their processors use the
+    same resize/normalization and tokenizer. Descriptions are deduplicated by their SHA1
+    and tokenized in batches of text_batch_size, padded to the fixed 77-token shape.
+
+    :param games_data: dict {game_id: {"images": [PIL.Image], "description": str}}
+    :param processor: CLIP processor used for both models
+    :param device: The device the tensors are moved to
+    :param text_batch_size: Number of descriptions per text batch
+    :return: dict with "pixel_values" ({game_id: tensor[5, 3, 224, 224]}), "text_batches"
+        (list of (digests, input_ids, attention_mask)) and "digests" ({game_id: sha1 digest})
     """
-    embeddings = {}
+    game_ids = list(games_data)
+
+    # Image preprocessing (5 images per game, one batch per game), moved to the device as a
+    # single pinned batch and split back into per-game views
+    game_pixel_values = [
+        processor(images=games_data[game_id]["images"], return_tensors="pt")["pixel_values"]
+        for game_id in tqdm(game_ids, desc="Preprocessing images")
+    ]
+    all_pixel_values = to_device(torch.cat(game_pixel_values), device, pin=True)
+    pixel_values = dict(
+        zip(game_ids, torch.split(all_pixel_values, [len(values) for values in game_pixel_values]))
+    )
 
-    model.eval()
-    with torch.no_grad():
-        for game_id, data in tqdm(games_data.items(), desc="Computing embeddings"):
-            images = data["images"]
-            description = data["description"]
+    # Tokenize each distinct description once
+    digests = {game_id: hashlib.sha1(games_data[game_id]["description"].encode()).digest() for game_id in game_ids}
+    unique = {}  # digest -> description, in first-seen order
+    for game_id in game_ids:
+        unique.setdefault(digests[game_id], games_data[game_id]["description"])
+    unique = list(unique.items())
+
+    text_batches = []
+    for start in range(0, len(unique), text_batch_size):
+        batch = unique[start : start + text_batch_size]
+        text_inputs = processor(
+            text=[description for _, description in batch],
+            return_tensors="pt",
+            padding="max_length",
+            truncation=True,
+            max_length=77,
+        )
+        text_batches.append(
+            (
+                [digest for digest, _ in batch],
+                to_device(text_inputs["input_ids"], device, pin=True),
+                to_device(text_inputs["attention_mask"], device, pin=True),
+            )
+        )
 
-            # Compute image embeddings (5 images per game)
-            image_embeds = []
-            for img in images:
-                img_inputs = processor(images=img, return_tensors="pt").to(device)
-                img_features = model.get_image_features(**img_inputs)
-                img_features = img_features / img_features.norm(dim=-1, keepdim=True)  # Normalize
-                image_embeds.append(img_features.cpu())
+    return {"pixel_values": pixel_values, "text_batches": text_batches, "digests": digests}
 
-            image_embeds = torch.cat(image_embeds, dim=0)  # [5, dim]
 
-            # Compute text embedding
-            text_inputs = processor(
-                text=[description], return_tensors="pt", padding=True, truncation=True, max_length=77
-            ).to(device)
-            text_features = model.get_text_features(**text_inputs)
-            text_features = text_features / text_features.norm(dim=-1, keepdim=True)  # Normalize
+def compute_embeddings_for_model(model, preprocessed):
+    """
+    Compute embeddings for all images and texts for all games from preprocessed inputs.
 
-            embeddings[game_id] = {"image_embeddings": image_embeds, "text_embedding": text_features.cpu()}
+    :param model: CLIP model (optionally wrapped by PEFT), already on the device
+    :param preprocessed: Output of preprocess_all
 
-    return embeddings
+    Returns:
+        dict: {game_id: {"image_embeddings": tensor[5, dim], "text_embedding": tensor[1, dim]}}
+    """
+    image_embeddings = {}
+    text_cache = {}  # sha1 digest -> tensor[dim]
+
+    model.eval()
+    # Pixel values are fed in the model's dtype (float16 on GPU, see load_model_from_minio)
+    model_dtype = next(model.parameters()).dtype
+    with torch.no_grad():
+        # Compute image embeddings (one forward pass per game)
+        for game_id, pixel_values in tqdm(preprocessed["pixel_values"].items(), desc="Computing image embeddings"):
+            img_features = model.get_image_features(pixel_values=pixel_values.to(model_dtype))
+            image_embeddings[game_id] = torch.nn.functional.normalize(img_features, dim=-1)  # [5, dim]
+
+        # Compute text embeddings, one forward pass per batch of distinct descriptions
+        for digests, input_ids, attention_mask in tqdm(preprocessed["text_batches"], desc="Computing text embeddings"):
+            text_features = model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+            for digest, text_feature in zip(digests, torch.nn.functional.normalize(text_features, dim=-1)):
+                text_cache[digest] = text_feature
+
+    # Move to the host in a single transfer once everything has been computed
+    # (saved embeddings stay float32)
+    game_ids = list(preprocessed["digests"])
+    all_images = torch.stack([image_embeddings[game_id] for game_id in game_ids]).float().cpu()  # [n, 5, dim]
+    all_texts = torch.stack([text_cache[preprocessed["digests"][game_id]] for game_id in game_ids]).float().cpu()
+
+    return {
+        game_id: {
+            "image_embeddings": all_images[i],
+            "text_embedding": all_texts[i : i + 1],  # [1, dim]
+        }
+        for i, game_id in enumerate(game_ids)
+    }
 
 
 def analysis_a_largest_differences(baseline_embeddings, fp16_embeddings):
@@ -222,30 +306,27 @@ def analysis_a_largest_differences(baseline_embeddings, fp16_embeddings):
     """
     logging.info("Analysis A: Finding games with largest embedding differences...")
 
-    differences = []
-
-    for game_id in baseline_embeddings.keys():
-        # Baseline: average of 5 images + 1 text (6 embeddings total)
-        baseline_imgs = baseline_embeddings[game_id]["image_embeddings"]  # [5, dim]
-        baseline_txt = baseline_embeddings[game_id]["text_embedding"]  # [1, dim]
-        baseline_all = torch.cat([baseline_imgs, baseline_txt], dim=0)  # [6, dim]
-        baseline_avg = baseline_all.mean(dim=0)  # [dim]
+    game_ids = list(baseline_embeddings.keys())
 
-        # FP16: average of 5 images + 1 text
-        fp16_imgs = fp16_embeddings[game_id]["image_embeddings"]  # [5, dim]
-        fp16_txt = fp16_embeddings[game_id]["text_embedding"]  # [1, dim]
-        fp16_all = torch.cat([fp16_imgs, fp16_txt], dim=0)  # [6, dim]
-        fp16_avg = fp16_all.mean(dim=0)  # [dim]
+    def stack_embeddings(embeddings):
+        # [N, 6, dim]: 5 images + 1 text per game
+        return torch.stack(
+            [torch.cat([embeddings[g]["image_embeddings"], embeddings[g]["text_embedding"]], dim=0) for g in game_ids]
+        )
 
-        # Euclidean distance between average embeddings
-        diff = torch.norm(baseline_avg - fp16_avg).item()
+    # Average of 5 images + 1 text (6 embeddings total) per game, for all games at once
+    baseline_avg = stack_embeddings(baseline_embeddings).mean(dim=1)  # [N, dim]
+    fp16_avg = stack_embeddings(fp16_embeddings).mean(dim=1)  # [N, dim]
 
-        differences.append((game_id, diff, baseline_avg.numpy(), fp16_avg.numpy()))
+    # Euclidean distance between average embeddings
+    diffs = (baseline_avg - fp16_avg).norm(dim=-1).numpy()  # [N]
 
-    # Sort by largest difference
-    differences.sort(key=lambda x: x[1], reverse=True)
+    # Select the 3 largest in O(N), then sort only those
+    k = min(3, len(game_ids))
+    candidates = np.argpartition(-diffs, k - 1)[:k] if k else np.array([], dtype=int)
+    top_idx = candidates[np.argsort(-diffs[candidates])]
 
-    top_3 = differences[:3]
+    top_3 = [(game_ids[i], float(diffs[i]), baseline_avg[i].numpy(), fp16_avg[i].numpy()) for i in top_idx]
 
     logging.info("\nTop 3 games with LARGEST embedding differences (baseline vs fp16):")
     for i, (game_id, diff, _, _) in enumerate(top_3, 1):
@@ -264,26 +345,18 @@ def analysis_b_lowest_similarity(baseline_embeddings):
     """
     logging.info("\nAnalysis B: Finding games with lowest similarity in baseline...")
 
-    similarities = []
+    game_ids = list(baseline_embeddings.keys())
+    image_embeds = torch.stack([baseline_embeddings[g]["image_embeddings"] for g in game_ids])  # [N, 5, dim]
+    text_embeds = torch.stack([baseline_embeddings[g]["text_embedding"].squeeze(0) for g in game_ids])  # [N, dim]
 
-    for game_id, embeds in baseline_embeddings.items():
-        image_embeds = embeds["image_embeddings"]  # [5, dim]
-        text_embed = embeds["text_embedding"]  # [1, dim]
+    # Cosine similarity between each image and the text of its game: the embeddings are
+    # unit-norm, so it is a dot product, computed for all games at once
+    avg_sims = (image_embeds * text_embeds.unsqueeze(1)).sum(dim=-1).mean(dim=-1).numpy()  # [N]
 
-        # Compute cosine similarity between each image and the text
-        sims = []
-        for i in range(5):
-            img_embed = image_embeds[i : i + 1]  # [1, dim]
-            sim = torch.nn.functional.cosine_similarity(img_embed, text_embed, dim=1).item()
-            sims.append(sim)
-
-        avg_sim = np.mean(sims)
-        similarities.append((game_id, avg_sim))
-
-    # Sort by lowest similarity
-    similarities.sort(key=lambda x: x[1])
-
-    top_3_worst = similarities[:3]
+    # Select the 3 lowest in O(N), then sort only those
+    k = min(3, len(game_ids))
+    candidates = np.argpartition(avg_sims, k - 1)[:k] if k else np.array([], dtype=int)
+    top_3_worst = [(game_ids[i], float(avg_sims[i])) for i in candidates[np.argsort(avg_sims[candidates])]]
 
     logging.info("\nTop 3 games with LOWEST similarity in baseline:")
     for i, (game_id, sim) in enumerate(top_3_worst, 1):
@@ -302,22 +375,17 @@ def save_results(baseline_embeddings, fp16_embeddings, games_data, analysis_a_re
 
     logging.info(f"\nSaving results to {output_dir}...")
 
-    # Save embeddings as numpy arrays
-    baseline_embeds_dict = {}
-    fp16_embeds_dict = {}
+    # Save embeddings as dense arrays: image_embeddings [N, 5, dim], text_embeddings [N, dim],
+    # row i belonging to game_ids[i] (no pickled objects)
+    game_ids = list(baseline_embeddings.keys())
 
-    for game_id in baseline_embeddings.keys():
-        baseline_embeds_dict[game_id] = {
-            "image_embeddings": baseline_embeddings[game_id]["image_embeddings"].numpy(),
-            "text_embedding": baseline_embeddings[game_id]["text_embedding"].numpy(),
-        }
-        fp16_embeds_dict[game_id] = {
-            "image_embeddings": fp16_embeddings[game_id]["image_embeddings"].numpy(),
-            "text_embedding": fp16_embeddings[game_id]["text_embedding"].numpy(),
-        }
-
-    np.save(os.path.join(output_dir, "embeddings_baseline.npy"), baseline_embeds_dict, allow_pickle=True)
-    np.save(os.path.join(output_dir, "embeddings_fp16.npy"), fp16_embeds_dict, allow_pickle=True)
+    for name, embeddings in (("baseline", baseline_embeddings), ("fp16", fp16_embeddings)):
+        np.savez_compressed(
+            os.path.join(output_dir, f"embeddings_{name}.npz"),
+            game_ids=np.array(game_ids),
+            image_embeddings=np.stack([embeddings[g]["image_embeddings"].numpy() for g in game_ids]),
+            text_embeddings=np.stack([embeddings[g]["text_embedding"].squeeze(0).numpy() for g in game_ids]),
+        )
 
     # Save game metadata
     metadata = {
@@ -343,23 +411,15 @@ def save_results(baseline_embeddings, fp16_embeddings, games_data, analysis_a_re
         json.dump(metadata, f, indent=4)
 
     logging.info("Results saved successfully!")
-    logging.info("  - embeddings_baseline.npy")
-    logging.info("  - embeddings_fp16.npy")
+    logging.info("  - embeddings_baseline.npz")
+    logging.info("  - embeddings_fp16.npz")
     logging.info("  - game_metadata.json")
 
 
 def main():
-    # Initialize MinIO client
-    try:
-        s3_client = boto3.client(
-            "s3",
-            endpoint_url=os.getenv("ENDPOINT_URL"),
-            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-        )
-        logging.info("Connected to MinIO.")
-    except Exception:
-        logging.exception("Error connecting to MinIO.")
+    # Initialize MinIO client (pooled connections shared by the download threads)
+    s3_client = minio_init()
+    if s3_client is None:
         return
 
     device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -371,7 +431,10 @@ def main():
     logging.info("=" * 60)
 
     baseline_model, baseline_processor = load_model_from_minio(s3_client, "baseline", device)
-    fp16_model, fp16_processor = load_model_from_minio(s3_client, "fp16", device)
+    fp16_model, _ = load_model_from_minio(s3_client, "fp16", device)
+
+    baseline_model = compile_for_inference(baseline_model, device)
+    fp16_model = compile_for_inference(fp16_model, device)
 
     # Step 2: Load all games data
     logging.info("\n" + "=" * 60)
@@ -380,39 +443,44 @@ def main():
 
     games_data = load_all_games_data(s3_client)
 
-    # Step 3: Compute embeddings for baseline
+    # Step 3: Preprocess images and descriptions once (same CLIP preprocessing for both models)
     logging.info("\n" + "=" * 60)
-    logging.info("STEP 3: Computing embeddings for BASELINE model")
+    logging.info("STEP 3: Preprocessing images and descriptions")
     logging.info("=" * 60)
 
-    baseline_embeddings = compute_embeddings_for_all_games(
-        baseline_model, baseline_processor, games_data, device
-    )
+    preprocessed = preprocess_all(games_data, baseline_processor, device)
+
+    # Step 4: Compute embeddings for baseline
+    logging.info("\n" + "=" * 60)
+    logging.info("STEP 4: Computing embeddings for BASELINE model")
+    logging.info("=" * 60)
+
+    baseline_embeddings = compute_embeddings_for_model(baseline_model, preprocessed)
 
-    # Step 4: Compute embeddings for fp16
+    # Step 5: Compute embeddings for fp16
     logging.info("\n" + "=" * 60)
-    logging.info("STEP 4: Computing embeddings for FP16 model")
+    logging.info("STEP 5: Computing embeddings for FP16 model")
     logging.info("=" * 60)
 
-    fp16_embeddings = compute_embeddings_for_all_games(fp16_model, fp16_processor, games_data, device)
+    fp16_embeddings = compute_embeddings_for_model(fp16_model, preprocessed)
 
-    # Step 5: Analysis A - Largest differences
+    # Step 6: Analysis A - Largest differences
     logging.info("\n" + "=" * 60)
-    logging.info("STEP 5: Analysis A - Games with largest embedding differences")
+    logging.info("STEP 6: Analysis A - Games with largest embedding differences")
     logging.info("=" * 60)
 
     analysis_a_results = analysis_a_largest_differences(baseline_embeddings, fp16_embeddings)
 
-    # Step 6: Analysis B - Lowest similarity in baseline
+    # Step 7: Analysis B - Lowest similarity in baseline
     logging.info("\n" + "=" * 60)
-    logging.info("STEP 6: Analysis B - Games with lowest similarity in baseline")
+    logging.info("STEP 7: Analysis B - Games with lowest similarity in baseline")
     logging.info("=" * 60)
 
     analysis_b_results = analysis_b_lowest_similarity(baseline_embeddings)
 
-    # Step 7: Save results
+    # Step 8: Save results
     logging.info("\n" + "=" * 60)
-    logging.info("STEP 7: Saving results for visualization")
+    logging.info("STEP 8: Saving results for visualization")
     logging.info("=" * 60)
 
     save_results(baseline_embeddings, fp16_embeddings, games_data, analysis_a_results, analysis_b_results)
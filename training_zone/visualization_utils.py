@@ -0,0 +1,164 @@
+"""
+Helpers shared by the visualization scripts: loading the results saved by test.py and
+plotting the 2D projection of a game.
+"""
+
+import json
+import logging
+import os
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "analysis_results")
+
+
+def load_embeddings(path):
+    """
+    Load the dense embedding arrays saved by test.py as a per-game view.
+
+    Returns:
+        dict: {game_id: {"image_embeddings": array[5, dim], "text_embedding": array[1, dim]}}
+    """
+    with np.load(path) as data:
+        game_ids = data["game_ids"]
+        image_embeddings = data["image_embeddings"]
+        text_embeddings = data["text_embeddings"]
+
+    return {
+        str(game_id): {"image_embeddings": image_embeddings[i], "text_embedding": text_embeddings[i : i + 1]}
+        for i, game_id in enumerate(game_ids)
+    }
+
+
+def load_analysis_results():
+    """Load embeddings and metadata from test.py results."""
+    logging.info(f"Loading results from {RESULTS_DIR}...")
+
+    baseline_embeddings = load_embeddings(os.path.join(RESULTS_DIR, "embeddings_baseline.npz"))
+    fp16_embeddings = load_embeddings(os.path.join(RESULTS_DIR, "embeddings_fp16.npz"))
+
+    with open(os.path.join(RESULTS_DIR, "game_metadata.json"), "r") as f:
+        metadata = json.load(f)
+
+    logging.info(f"Loaded embeddings for {len(baseline_embeddings)} games.")
+
+    return baseline_embeddings, fp16_embeddings, metadata
+
+
+def stack_game_embeddings(baseline_embeddings, fp16_embeddings):
+    """
+    Stack the embeddings of a single game from both models.
+
+    Args:
+        baseline_embeddings: dict with 'image_embeddings' [5, dim] and 'text_embedding' [1, dim]
+        fp16_embeddings: dict with 'image_embeddings' [5, dim] and 'text_embedding' [1, dim]
+
+    Returns:
+        np.ndarray: [12, dim] array (baseline images, baseline text, fp16 images, fp16 text)
+    """
+    return np.vstack(
+        [
+            baseline_embeddings["image_embeddings"],  # [5, dim]
+            baseline_embeddings["text_embedding"],  # [1, dim]
+            fp16_embeddings["image_embeddings"],  # [5, dim]
+            fp16_embeddings["text_embedding"],  # [1, dim]
+        ]
+    )
+
+
+def plot_model_points(ax, points_2d, color, label):
+    """
+    Plot the 5 images and the description of one model.
+
+    Args:
+        ax: matplotlib axes to draw on
+        points_2d: [6, 2] array (5 images + 1 description)
+        color: str, color of the model
+        label: str, legend label of the model
+    """
+    # Plot the 5 images
+    ax.scatter(
+        points_2d[:5, 0],
+        points_2d[:5, 1],
+        c=color,
+        marker="o",
+        s=250,
+        alpha=0.7,
+        label=label,
+        edgecolors="black",
+        linewidths=2,
+    )
+    # Add image labels
+    for i in range(5):
+        ax.annotate(
+            f"Img{i + 1}",
+            (points_2d[i, 0], points_2d[i, 1]),
+            textcoords="offset points",
+            xytext=(0, 10),
+            ha="center",
+            fontsize=9,
+            fontweight="bold",
+            color=color,
+        )
+    # Plot the description
+    ax.scatter(
+        points_2d[5, 0],
+        points_2d[5, 1],
+        c=color,
+        marker="o",
+        s=250,
+        alpha=0.7,
+        edgecolors="black",
+        linewidths=2,
+    )
+    ax.annotate(
+        "Desc",
+        (points_2d[5, 0], points_2d[5, 1]),
+        textcoords="offset points",
+        xytext=(0, 10),
+        ha="center",
+        fontsize=9,
+        fontweight="bold",
+        color=color,
+    )
+
+
+def plot_game_both_models(embeds_2d, game_id, output_path, xlabel, ylabel):
+    """
+    Save the 2D plot of a single game showing both baseline and fp16 models.
+
+    Args:
+        embeds_2d: [12, 2] projection of stack_game_embeddings (baseline first, then fp16)
+        game_id: str, the game identifier
+        output_path: str, path of the PNG to write
+        xlabel: str, label of the first dimension
+        ylabel: str, label of the second dimension
+    """
+    # Create plot
+    fig, ax = plt.subplots(figsize=(12, 10))
+
+    # Baseline model (blue), then fp16 model (orange): 5 images + 1 text each
+    plot_model_points(ax, embeds_2d[:6], "#3498db", "Baseline")
+    plot_model_points(ax, embeds_2d[6:], "#ff7f0e", "FP16")
+
+    # Formatting
+    ax.set_xlabel(xlabel, fontsize=12)
+    ax.set_ylabel(ylabel, fontsize=12)
+    ax.set_title(
+        f"Game {game_id} - Baseline vs FP16",
+        fontsize=14,
+        fontweight="bold",
+    )
+    ax.legend(loc="best", fontsize=12, framealpha=0.9)
+    ax.grid(True, alpha=0.3)
+
+    # Set equal aspect ratio for better visualization
+    ax.set_aspect("equal", adjustable="box")
+
+    plt.tight_layout()
+
+    # Save
+    plt.savefig(output_path, dpi=300, bbox_inches="tight")
+    logging.info(f"Saved: {os.path.basename(output_path)}")
+    plt.close(fig)
@@ -7,13 +7,11 @@ For each of the top 3 games with largest differences, creates:
 Total: 3 plots
 """
 
-import json
 import logging
 import os
 
-import matplotlib.pyplot as plt
-import numpy as np
 from sklearn.decomposition import PCA
+from visualization_utils import load_analysis_results, plot_game_both_models, stack_game_embeddings
 
 logging.basicConfig(
     level=logging.INFO,
@@ -22,27 +20,7 @@ logging.basicConfig(
 )
 
 
-def load_analysis_results():
-    """Load embeddings and metadata from test.py results."""
-    results_dir = os.path.join(os.path.dirname(__file__), "analysis_results")
-
-    logging.info(f"Loading results from {results_dir}...")
-
-    baseline_embeddings = np.load(
-        os.path.join(results_dir, "embeddings_baseline.npy"), allow_pickle=True
-    ).item()
-
-    fp16_embeddings = np.load(os.path.join(results_dir, "embeddings_fp16.npy"), allow_pickle=True).item()
-
-    with open(os.path.join(results_dir, "game_metadata.json"), "r") as f:
-        metadata = json.load(f)
-
-    logging.info(f"Loaded embeddings for {len(baseline_embeddings)} games.")
-
-    return baseline_embeddings, fp16_embeddings, metadata
-
-
-def plot_game_both_models(baseline_embeddings, fp16_embeddings, game_id, output_dir):
+def plot_game_pca(baseline_embeddings, fp16_embeddings, game_id, output_dir):
     """
     Create a 2D PCA plot for a single game showing both baseline and fp16 models.
 
@@ -53,139 +31,19 @@ def plot_game_both_models(baseline_embeddings, fp16_embeddings, game_id, output_
         output_dir: str, directory to save the plot
     """
     # Stack all embeddings from both models
-    baseline_images = baseline_embeddings["image_embeddings"]  # [5, dim]
-    baseline_text = baseline_embeddings["text_embedding"]  # [1, dim]
-    fp16_images = fp16_embeddings["image_embeddings"]  # [5, dim]
-    fp16_text = fp16_embeddings["text_embedding"]  # [1, dim]
-
-    all_embeds = np.vstack([baseline_images, baseline_text, fp16_images, fp16_text])  # [12, dim]
+    all_embeds = stack_game_embeddings(baseline_embeddings, fp16_embeddings)  # [12, dim]
 
     # Apply PCA to reduce to 2D
     pca = PCA(n_components=2)
     embeds_2d = pca.fit_transform(all_embeds)
 
-    # Split back into baseline and fp16
-    baseline_2d = embeds_2d[:6]  # 5 images + 1 text
-    fp16_2d = embeds_2d[6:]  # 5 images + 1 text
-
-    # Create plot
-    fig, ax = plt.subplots(figsize=(12, 10))
-
-    # Plot baseline model (blue)
-    # Plot the 5 images
-    ax.scatter(
-        baseline_2d[:5, 0],
-        baseline_2d[:5, 1],
-        c="#3498db",
-        marker="o",
-        s=250,
-        alpha=0.7,
-        label="Baseline",
-        edgecolors="black",
-        linewidths=2,
-    )
-    # Add image labels
-    for i in range(5):
-        ax.annotate(
-            f"Img{i + 1}",
-            (baseline_2d[i, 0], baseline_2d[i, 1]),
-            textcoords="offset points",
-            xytext=(0, 10),
-            ha="center",
-            fontsize=9,
-            fontweight="bold",
-            color="#3498db",
-        )
-    # Plot the description
-    ax.scatter(
-        baseline_2d[5, 0],
-        baseline_2d[5, 1],
-        c="#3498db",
-        marker="o",
-        s=250,
-        alpha=0.7,
-        edgecolors="black",
-        linewidths=2,
-    )
-    ax.annotate(
-        "Desc",
-        (baseline_2d[5, 0], baseline_2d[5, 1]),
-        textcoords="offset points",
-        xytext=(0, 10),
-        ha="center",
-        fontsize=9,
-        fontweight="bold",
-        color="#3498db",
-    )
-
-    # Plot fp16 model (orange)
-    # Plot the 5 images
-    ax.scatter(
-        fp16_2d[:5, 0],
-        fp16_2d[:5, 1],
-        c="#ff7f0e",
-        marker="o",
-        s=250,
-        alpha=0.7,
-        label="FP16",
-        edgecolors="black",
-        linewidths=2,
-    )
-    # Add image labels
-    for i in range(5):
-        ax.annotate(
-            f"Img{i + 1}",
-            (fp16_2d[i, 0], fp16_2d[i, 1]),
-            textcoords="offset points",
-            xytext=(0, 10),
-            ha="center",
-            fontsize=9,
-            fontweight="bold",
-            color="#ff7f0e",
-        )
-    # Plot the description
-    ax.scatter(
-        fp16_2d[5, 0],
-        fp16_2d[5, 1],
-        c="#ff7f0e",
-        marker="o",
-        s=250,
-        alpha=0.7,
-        edgecolors="black",
-        linewidths=2,
-    )
-    ax.annotate(
-        "Desc",
-        (fp16_2d[5, 0], fp16_2d[5, 1]),
-        textcoords="offset points",
-        xytext=(0, 10),
-        ha="center",
-        fontsize=9,
-        fontweight="bold",
-        color="#ff7f0e",
-    )
-
-    # Formatting
-    ax.set_xlabel(f"PC1 ({pca.explained_variance_ratio_[0] * 100:.1f}% Variance)", fontsize=12)
-    ax.set_ylabel(f"PC2 ({pca.explained_variance_ratio_[1] * 100:.1f}% Variance)", fontsize=12)
-    ax.set_title(
-        f"Game {game_id} - Baseline vs FP16",
-        fontsize=14,
-        fontweight="bold",
+    plot_game_both_models(
+        embeds_2d,
+        game_id,
+        os.path.join(output_dir, f"pca_game_{game_id}_both_models.png"),
+        xlabel=f"PC1 ({pca.explained_variance_ratio_[0] * 100:.1f}% Variance)",
+        ylabel=f"PC2 ({pca.explained_variance_ratio_[1] * 100:.1f}% Variance)",
     )
-    ax.legend(loc="best", fontsize=12, framealpha=0.9)
-    ax.grid(True, alpha=0.3)
-
-    # Set equal aspect ratio for better visualization
-    ax.set_aspect("equal", adjustable="box")
-
-    plt.tight_layout()
-
-    # Save
-    output_path = os.path.join(output_dir, f"pca_game_{game_id}_both_models.png")
-    plt.savefig(output_path, dpi=300, bbox_inches="tight")
-    logging.info(f"Saved: pca_game_{game_id}_both_models.png")
-    plt.close()
 
 
 def main():
@@ -212,7 +70,7 @@ def main():
 
     for game_id in top_games:
         logging.info(f"Processing Game {game_id}...")
-        plot_game_both_models(baseline_embeddings[game_id], fp16_embeddings[game_id], game_id, output_dir)
+        plot_game_pca(baseline_embeddings[game_id], fp16_embeddings[game_id], game_id, output_dir)
 
     logging.info("\n" + "=" * 60)
     logging.info("VISUALIZATION COMPLETE!")
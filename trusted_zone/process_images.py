@@ -1,10 +1,16 @@
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from io import BytesIO
-from PIL import Image, ImageOps
+import cv2
+import numpy as np
+from PIL import Image
 import dotenv
 import os
-from global_scripts.utils import minio_init, delete_items
+from global_scripts.utils import minio_init, is_up_to_date, source_metadata, delete_stale_items
 
 
 dotenv.load_dotenv(dotenv.find_dotenv())
@@ -14,62 +20,200 @@ logging.basicConfig(
     format='%(asctime)s - [%(levelname)s] - %(message)s',
     force=True
 )
-    
+
+# Bucket names, read once (not on every object)
+FORMATTED_ZONE_BUCKET = os.getenv("FORMATTED_ZONE_BUCKET")
+TRUSTED_ZONE_BUCKET = os.getenv("TRUSTED_ZONE_BUCKET")
+
+
+# Side of the square trusted-zone images
+TARGET_SIZE = 256
+
+# Version of the processing below, stored on every trusted-zone object: bump it whenever
+# the output would change, so objects produced by an older version are regenerated
+PROCESSING_VERSION = '2'
+
+# Images handed to a pool worker per round-trip, and pooled connections per worker
+WORKER_CHUNKSIZE = 16
+WORKER_POOL_CONNECTIONS = 4
+
+
+def equalize(arr):
+    """
+    Histogram equalization of the luma channel of a BGR image (YCrCb space), which
+    standardizes brightness without shifting hues like per-channel RGB equalization does.
+
+    :param arr: BGR uint8 array of shape (height, width, 3)
+    :return: Equalized BGR uint8 array
+    """
+    ycrcb = cv2.cvtColor(arr, cv2.COLOR_BGR2YCrCb)
+    ycrcb[..., 0] = cv2.equalizeHist(ycrcb[..., 0])
+    return cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2BGR)
+
+
+def jpeg_reduction(file_content, size=TARGET_SIZE):
+    """
+    Picks the OpenCV read flag decoding a JPEG directly at the smallest DCT scale (1/2, 1/4
+    or 1/8) that still keeps both sides at least size pixels. Only the header is parsed.
+
+    :param file_content: Encoded image bytes
+    :param size: Minimum side of the decoded image
+    :return: cv2.IMREAD_* flag
+    """
+    with Image.open(BytesIO(file_content)) as probe:
+        if probe.format != 'JPEG':
+            return cv2.IMREAD_COLOR
+        shortest = min(probe.size)
+
+    for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if shortest // factor >= size:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def pad(arr, size=TARGET_SIZE):
+    """
+    Resize an image to fit a size x size square keeping its aspect ratio, centered on a black canvas.
+
+    :param arr: uint8 array of shape (height, width, 3)
+    :param size: Side of the output square
+    :return: uint8 array of shape (size, size, 3)
+    """
+    height, width = arr.shape[:2]
+    scale = size / max(height, width)
+    new_width, new_height = max(1, round(width * scale)), max(1, round(height * scale))
+    resized = cv2.resize(arr, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+    canvas = np.zeros((size, size, 3), dtype=np.uint8)
+    top, left = (size - new_height) // 2, (size - new_width) // 2
+    canvas[top:top + new_height, left:left + new_width] = resized
+    return canvas
+
+
+# Per-process MinIO client, created by the pool initializer (boto3 clients are not fork-safe)
+_worker_client = None
+
+
+def init_worker():
+    """
+    Process pool initializer: open one MinIO client per worker process and keep OpenCV
+    single-threaded, since the pool already runs one worker per core.
+    """
+    global _worker_client
+    cv2.setNumThreads(1)
+    # A worker handles one image at a time: a few pooled connections are enough
+    _worker_client = minio_init(Config(max_pool_connections=WORKER_POOL_CONNECTIONS))
+
+
+def process_image(source, trusted_zone_prefix):
+    """
+    Processes a single image from the formatted zone and uploads it to the trusted zone.
+    Runs inside a pool worker, using the client created by init_worker. Images already
+    produced from the same source version (same ETag) by the same PROCESSING_VERSION are
+    skipped.
+
+    :param source: Tuple of (key, ETag) of the image in the formatted zone
+    :param trusted_zone_prefix: Prefix for the trusted zone
+    :return: True if the image is up to date in the trusted zone, False otherwise
+    """
+    s3_client = _worker_client
+    key, etag = source
+
+    # Define new key for trusted zone
+    base_name = key.split('/')[-1]
+    new_key = f"{trusted_zone_prefix}{base_name}"
+
+    try:
+        if is_up_to_date(s3_client, TRUSTED_ZONE_BUCKET, new_key, etag, PROCESSING_VERSION):
+            logging.info(f"Skipping unchanged image: {key}")
+            return True
+
+        logging.info(f"Processing image: {key}")
+
+        # Get the image from MinIO
+        response = s3_client.get_object(Bucket=FORMATTED_ZONE_BUCKET, Key=key)
+        file_content = response['Body'].read()
+
+        # Decode and ensure is not corrupted. Large JPEGs are decoded directly at a reduced
+        # scale (DCT scaling): the output is 256x256 anyway. All images get the same 3 channels
+        # (without A), in OpenCV's BGR order
+        arr = cv2.imdecode(np.frombuffer(file_content, np.uint8), jpeg_reduction(file_content))
+        if arr is None:
+            raise ValueError("Image could not be decoded")
+
+        # Standardize brightness with Histogram Equalization
+        arr = equalize(arr)
+
+        # Standardize image resolution
+        arr = pad(arr)
+
+        # Encode to JPEG (removes metadata)
+        ok, encoded = cv2.imencode('.jpg', arr, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        if not ok:
+            raise ValueError("JPEG encoding failed")
+
+        # Upload to trusted zone (single PUT: small files do not need the managed transfer machinery)
+        s3_client.put_object(
+            Bucket=TRUSTED_ZONE_BUCKET,
+            Key=new_key,
+            Body=encoded.tobytes(),
+            ContentType='image/jpeg',
+            Metadata=source_metadata(etag, PROCESSING_VERSION),
+        )
+        logging.info(f"Successfully processed and uploaded: {new_key}")
+        return True
+    except ClientError as e:
+        logging.error(f"Boto3 error processing image {key}: {e}")
+    except Exception as e:
+        logging.error(f"Unexpected error processing image {key}: {e}")
+    return False
+
 
 def process_images(s3_client, formatted_zone_prefix, trusted_zone_prefix):
     """
     Processes images from the formatted zone and uploads them to the trusted zone.
+    Images are independent, so they are processed in parallel by a pool of processes
+    (decode, equalization, padding and encoding are CPU-bound).
     
     :param s3_client: Boto3 S3 client
     :param formatted_zone_prefix: Prefix for the formatted zone
     :param trusted_zone_prefix: Prefix for the trusted zone
     """
     try:
-        # List objects in the formatted zone
-        objects = s3_client.list_objects_v2(Bucket=os.getenv("FORMATTED_ZONE_BUCKET"), Prefix=formatted_zone_prefix)
-        if 'Contents' not in objects:
+        # List objects in the formatted zone (paginated: a single call stops at 1000 keys).
+        # Keys are streamed page by page, so processing starts before the listing completes
+        paginator = s3_client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(
+            Bucket=FORMATTED_ZONE_BUCKET, Prefix=formatted_zone_prefix, PaginationConfig={'PageSize': 1000}
+        )
+        sources = []  # (key, ETag), filled as the pages are consumed by the pool
+
+        def list_sources():
+            for page in pages:
+                for obj in page.get('Contents', []):
+                    if not obj['Key'].endswith('/'):
+                        sources.append((obj['Key'], obj['ETag']))
+                        yield sources[-1]
+
+        # forkserver: workers do not inherit the parent's client or threads
+        with ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=init_worker,
+        ) as executor:
+            results = list(
+                executor.map(partial(process_image, trusted_zone_prefix=trusted_zone_prefix), list_sources(), chunksize=WORKER_CHUNKSIZE)
+            )
+
+        # Remove the trusted-zone images whose source is gone or could not be processed
+        keep_keys = {f"{trusted_zone_prefix}{key.split('/')[-1]}" for (key, _), ok in zip(sources, results) if ok}
+        delete_stale_items(s3_client, TRUSTED_ZONE_BUCKET, trusted_zone_prefix, keep_keys)
+
+        if not results:
             logging.info(f"No images found in {formatted_zone_prefix}.")
             return
 
-        for obj in objects['Contents']:
-            key = obj['Key']
-            if key.endswith('/'):
-                continue
-            logging.info(f"Processing image: {key}")
-            try:
-                # Get the image from MinIO
-                response = s3_client.get_object(Bucket=os.getenv("FORMATTED_ZONE_BUCKET"), Key=key)
-                file_content = response['Body'].read()
-
-                # Open image and ensure is not corrupted
-                img = Image.open(BytesIO(file_content))
-                img.load()
-
-                # All images have the same channels (without A)
-                img = img.convert('RGB')
-
-                # Standardize brightness with Histogram Equalization
-                img = ImageOps.equalize(img)
-
-                # Standardize image resolution
-                img = ImageOps.pad(img, (256, 256))
-
-                # Save to buffer (removes metadata)
-                buffer = BytesIO()
-                img.save(buffer, format='JPEG')
-                buffer.seek(0)
-
-                # Define new key for trusted zone
-                base_name = key.split('/')[-1]
-                new_key = f"{trusted_zone_prefix}{base_name}"
-
-                # Upload to trusted zone
-                s3_client.upload_fileobj(buffer, os.getenv("TRUSTED_ZONE_BUCKET"), new_key)
-                logging.info(f"Successfully processed and uploaded: {new_key}")
-            except ClientError as e:
-                logging.error(f"Boto3 error processing image {key}: {e}")
-            except Exception as e:
-                logging.error(f"Unexpected error processing image {key}: {e}")
+        logging.info(f"{sum(results)}/{len(results)} images up to date in the trusted zone.")
     except ClientError as e:
         logging.critical(f"Boto3 error listing images in {formatted_zone_prefix}: {e}", exc_info=True)
     except Exception as e:
@@ -79,7 +223,6 @@ def process_images(s3_client, formatted_zone_prefix, trusted_zone_prefix):
 def main():
 
     s3_client = minio_init()
-    delete_items(s3_client, bucket=os.getenv("TRUSTED_ZONE_BUCKET"), prefix="media/image/")
     process_images(
         s3_client,
         formatted_zone_prefix="media/image/",
@@ -1,10 +1,11 @@
-import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
 import dotenv
 import os
 import numbers
-from global_scripts.utils import minio_init
+import orjson
+from global_scripts.utils import minio_init, is_up_to_date, source_metadata
 
 dotenv.load_dotenv(dotenv.find_dotenv())
 
@@ -14,6 +15,14 @@ logging.basicConfig(
     force=True 
 )
 
+# Bucket names, read once (not on every object)
+FORMATTED_ZONE_BUCKET = os.getenv("FORMATTED_ZONE_BUCKET")
+TRUSTED_ZONE_BUCKET = os.getenv("TRUSTED_ZONE_BUCKET")
+
+# Version of the processing below, stored on every trusted-zone object: bump it whenever
+# the output would change, so objects produced by an older version are regenerated
+PROCESSING_VERSION = '2'
+
 STEAM_REQUIRED_KEYS = [
     "name", "release_date", "required_age", "price", "dlc_count",
     "detailed_description", "about_the_game", "header_image", "support_url",
@@ -42,87 +51,210 @@ EXPECTED_INT_FIELDS_STEAMSPY = [
 EXPECTED_NUMERIC_FIELDS_STEAM = ["price"]
 EXPECTED_DICT_FIELDS_STEAMSPY = ["tags"]
 
+# Validate with the reference implementation (make_validator) instead of the generated code,
+# e.g. to step through the checks in a debugger
+DEBUG_VALIDATOR = os.getenv("DEBUG_JSON_VALIDATOR") == "1"
+
 
-def validate_and_clean_entry(game_id, game_data, required_keys, dataset_name):
+def dataset_fields(dataset_name):
     """
-    Validates and cleans a single game entry.
+    Resolves the field lists checked for a dataset.
+
+    :param dataset_name: Name of the dataset (e.g., "Steam" or "SteamSpy")
+    :return: Tuple of (int, numeric, bool, list, dict, non-negative) field lists
+    """
+    return (
+        EXPECTED_INT_FIELDS_STEAM if dataset_name == "Steam" else EXPECTED_INT_FIELDS_STEAMSPY,
+        EXPECTED_NUMERIC_FIELDS_STEAM if dataset_name == "Steam" else [],
+        EXPECTED_BOOL_FIELDS,
+        EXPECTED_LIST_FIELDS,
+        EXPECTED_DICT_FIELDS_STEAMSPY if dataset_name == "SteamSpy" else [],
+        NON_NEGATIVE_STEAM_FIELDS if dataset_name == "Steam" else [],
+    )
+
+
+def make_validator(required_keys, dataset_name):
+    """
+    Builds the entry validator of a dataset. The dataset-specific field lists are resolved
+    once here instead of on every entry, and the required keys are checked as a set difference.
 
-    :param game_id: The ID of the game
-    :param game_data: The dictionary containing game data
     :param required_keys: List of required keys for validation
     :param dataset_name: Name of the dataset (e.g., "Steam" or "SteamSpy")
-    :return: Cleaned game data dictionary if valid, else None
+    :return: Function (game_id, game_data) -> cleaned game data dictionary if valid, else None
     """
-    missing_keys = [key for key in required_keys if key not in game_data]
-    if missing_keys:
-        logging.warning(f"[{dataset_name} ID: {game_id}] Missing required keys: {missing_keys}. Skipping entry.")
-        return None
-
-    cleaned_data = game_data.copy()
-
-    # type validation
-    expected_int_fields = EXPECTED_INT_FIELDS_STEAM if dataset_name == "Steam" else EXPECTED_INT_FIELDS_STEAMSPY
-    expected_numeric_fields = EXPECTED_NUMERIC_FIELDS_STEAM if dataset_name == "Steam" else []
-    expected_dict_fields = EXPECTED_DICT_FIELDS_STEAMSPY if dataset_name == "SteamSpy" else []
-
-    # check integers
-    for field in expected_int_fields:
-        value = cleaned_data.get(field)
-        if value is not None and not isinstance(value, int):
-            try:
-                cleaned_data[field] = int(value)
-            except (ValueError, TypeError):
-                 logging.warning(f"[{dataset_name} ID: {game_id}] Field '{field}' has non-integer value '{value}'. Skipping entry.")
-                 return None
-
-    # check numerics
-    for field in expected_numeric_fields:
-         value = cleaned_data.get(field)
-         if value is not None and not isinstance(value, numbers.Number):
-             try:
-                 cleaned_data[field] = float(value)
-             except (ValueError, TypeError):
-                  logging.warning(f"[{dataset_name} ID: {game_id}] Field '{field}' has non-numeric value '{value}'. Skipping entry.")
-                  return None
-
-    # check Booleans
-    for field in EXPECTED_BOOL_FIELDS:
-        if field in cleaned_data and not isinstance(cleaned_data.get(field), bool):
-            logging.warning(f"[{dataset_name} ID: {game_id}] Field '{field}' has non-boolean value '{cleaned_data.get(field)}'. Skipping entry.")
-            return None 
-
-    # check that Lists are Lists
-    for field in EXPECTED_LIST_FIELDS:
-        if field in cleaned_data:
+    required = frozenset(required_keys)
+    (
+        expected_int_fields, expected_numeric_fields, bool_fields,
+        list_fields, expected_dict_fields, non_negative_fields
+    ) = dataset_fields(dataset_name)
+    Number = numbers.Number
+
+    def validate_and_clean_entry(game_id, game_data):
+        """
+        Validates and cleans a single game entry. The entry is cleaned in place (no per-entry
+        copy): it comes from a freshly parsed file that is discarded after processing.
+
+        :param game_id: The ID of the game
+        :param game_data: The dictionary containing game data
+        :return: Cleaned game data dictionary if valid, else None
+        """
+        if not required <= game_data.keys():
+            missing_keys = [key for key in required_keys if key not in game_data]
+            logging.warning(f"[{dataset_name} ID: {game_id}] Missing required keys: {missing_keys}. Skipping entry.")
+            return None
+
+        cleaned_data = game_data
+
+        # check integers
+        for field in expected_int_fields:
+            value = cleaned_data.get(field)
+            if value is not None and not isinstance(value, int):
+                try:
+                    cleaned_data[field] = int(value)
+                except (ValueError, TypeError):
+                    logging.warning(f"[{dataset_name} ID: {game_id}] Field '{field}' has non-integer value '{value}'. Skipping entry.")
+                    return None
+
+        # check numerics
+        for field in expected_numeric_fields:
             value = cleaned_data.get(field)
-            if value is None:
-                cleaned_data[field] = [] 
-            elif not isinstance(value, list):
-                logging.warning(f"[{dataset_name} ID: {game_id}] Field '{field}' expected list, got {type(value).__name__}. Skipping entry.")
+            if value is not None and not isinstance(value, Number):
+                try:
+                    cleaned_data[field] = float(value)
+                except (ValueError, TypeError):
+                    logging.warning(f"[{dataset_name} ID: {game_id}] Field '{field}' has non-numeric value '{value}'. Skipping entry.")
+                    return None
+
+        # check Booleans
+        for field in bool_fields:
+            if field in cleaned_data and not isinstance(cleaned_data.get(field), bool):
+                logging.warning(f"[{dataset_name} ID: {game_id}] Field '{field}' has non-boolean value '{cleaned_data.get(field)}'. Skipping entry.")
                 return None
 
-    # check that Dicts are Dicts
-    for field in expected_dict_fields:
-         if field in cleaned_data:
+        # check that Lists are Lists
+        for field in list_fields:
+            if field in cleaned_data:
+                value = cleaned_data.get(field)
+                if value is None:
+                    cleaned_data[field] = []
+                elif not isinstance(value, list):
+                    logging.warning(f"[{dataset_name} ID: {game_id}] Field '{field}' expected list, got {type(value).__name__}. Skipping entry.")
+                    return None
+
+        # check that Dicts are Dicts
+        for field in expected_dict_fields:
+            if field in cleaned_data:
+                value = cleaned_data.get(field)
+                if value is None:
+                    cleaned_data[field] = {}
+                elif not isinstance(value, dict):
+                    logging.warning(f"[{dataset_name} ID: {game_id}] Field '{field}' expected dict, got {type(value).__name__}. Skipping entry.")
+                    return None
+
+        # check non negative
+        for field in non_negative_fields:
             value = cleaned_data.get(field)
-            if value is None:
-                cleaned_data[field] = {} 
-            elif not isinstance(value, dict):
-                 logging.warning(f"[{dataset_name} ID: {game_id}] Field '{field}' expected dict, got {type(value).__name__}. Skipping entry.")
-                 return None
-
-    # check non negative
-    if dataset_name == "Steam":
-        for field in NON_NEGATIVE_STEAM_FIELDS:
-            value = cleaned_data.get(field)
-            if isinstance(value, numbers.Number) and value < 0:
+            if isinstance(value, Number) and value < 0:
                 logging.warning(f"[{dataset_name} ID: {game_id}] Field '{field}' has negative value {value}. Correcting to 0.")
-                cleaned_data[field] = 0 
+                cleaned_data[field] = 0
+
+        return cleaned_data
 
-    return cleaned_data
+    return validate_and_clean_entry
 
 
-def process_json_trusted(s3_client, formatted_zone_path, trusted_zone_path, required_keys, dataset_name):
+def build_validator(required_keys, dataset_name):
+    """
+    Builds the entry validator of a dataset as generated code: the checks of make_validator
+    are unrolled into straight-line source, one block per field with the field name and the
+    warning text as literals, and compiled once. Uses make_validator (the reference
+    implementation) instead when DEBUG_VALIDATOR is set.
+
+    :param required_keys: List of required keys for validation
+    :param dataset_name: Name of the dataset (e.g., "Steam" or "SteamSpy")
+    :return: Function (game_id, game_data) -> cleaned game data dictionary if valid, else None
+    """
+    if DEBUG_VALIDATOR:
+        return make_validator(required_keys, dataset_name)
+
+    int_fields, numeric_fields, bool_fields, list_fields, dict_fields, non_negative_fields = dataset_fields(dataset_name)
+    prefix = f"[{dataset_name} ID: {{game_id}}]"
+
+    def warn(message):
+        return f"            _warning(f{(prefix + ' ' + message)!r})"
+
+    lines = [
+        "def validate_and_clean_entry(game_id, g):",
+        "    if not _required <= g.keys():",
+        "        missing_keys = [key for key in _required_keys if key not in g]",
+        f"        _warning(f{(prefix + ' Missing required keys: {missing_keys}. Skipping entry.')!r})",
+        "        return None",
+    ]
+    for field in int_fields:
+        lines += [
+            f"    v = g.get({field!r})",
+            "    if v is not None and not isinstance(v, int):",
+            "        try:",
+            f"            g[{field!r}] = int(v)",
+            "        except (ValueError, TypeError):",
+            warn(f"Field '{field}' has non-integer value '{{v}}'. Skipping entry."),
+            "            return None",
+        ]
+    for field in numeric_fields:
+        lines += [
+            f"    v = g.get({field!r})",
+            "    if v is not None and not isinstance(v, _Number):",
+            "        try:",
+            f"            g[{field!r}] = float(v)",
+            "        except (ValueError, TypeError):",
+            warn(f"Field '{field}' has non-numeric value '{{v}}'. Skipping entry."),
+            "            return None",
+        ]
+    for field in bool_fields:
+        lines += [
+            f"    if {field!r} in g:",
+            f"        v = g[{field!r}]",
+            "        if not isinstance(v, bool):",
+            warn(f"Field '{field}' has non-boolean value '{{v}}'. Skipping entry."),
+            "            return None",
+        ]
+    for field, expected, empty in [(f, 'list', '[]') for f in list_fields] + [(f, 'dict', '{}') for f in dict_fields]:
+        lines += [
+            f"    if {field!r} in g:",
+            f"        v = g[{field!r}]",
+            "        if v is None:",
+            f"            g[{field!r}] = {empty}",
+            f"        elif not isinstance(v, {expected}):",
+            warn(f"Field '{field}' expected {expected}, got {{type(v).__name__}}. Skipping entry."),
+            "            return None",
+        ]
+    for field in non_negative_fields:
+        lines += [
+            f"    v = g.get({field!r})",
+            "    if isinstance(v, _Number) and v < 0:",
+            warn(f"Field '{field}' has negative value {{v}}. Correcting to 0.")[4:],
+            f"        g[{field!r}] = 0",
+        ]
+    lines.append("    return g")
+
+    namespace = {
+        '_required': frozenset(required_keys),
+        '_required_keys': list(required_keys),
+        '_warning': logging.warning,
+        '_Number': numbers.Number,
+    }
+    exec(compile("\n".join(lines), f"<{dataset_name} validator>", "exec"), namespace)
+    return namespace['validate_and_clean_entry']
+
+
+# Entry validators, built once at import rather than on every processed file
+VALIDATORS = {
+    "Steam": build_validator(STEAM_REQUIRED_KEYS, "Steam"),
+    "SteamSpy": build_validator(STEAMSPY_REQUIRED_KEYS, "SteamSpy"),
+}
+
+
+def process_json_trusted(s3_client, formatted_zone_path, trusted_zone_path, dataset_name):
     """
     Processes JSON files from the formatted zone, validates and cleans the data,
     and uploads the cleaned data to the trusted zone.
@@ -130,35 +262,54 @@ def process_json_trusted(s3_client, formatted_zone_path, trusted_zone_path, requ
     :param s3_client: Boto3 S3 client
     :param formatted_zone_path: Prefix for the formatted zone
     :param trusted_zone_path: Prefix for the trusted zone
-    :param required_keys: List of required keys for validation
-    :param dataset_name: Name of the dataset (e.g., "Steam" or "SteamSpy")
+    :param dataset_name: Name of the dataset, key of VALIDATORS ("Steam" or "SteamSpy")
     """
     processed_data = {}
     invalid_entry_count = 0
     total_entries_read = 0
 
     try:
-        objects = s3_client.list_objects_v2(Bucket=os.getenv("FORMATTED_ZONE_BUCKET"), Prefix=formatted_zone_path)
-        if 'Contents' not in objects or not objects['Contents']:
-            logging.info(f"No files found in {formatted_zone_path}.")
-            return
+        # Paginated listing (a single call stops at 1000 keys), stopping at the first JSON file
+        paginator = s3_client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(
+            Bucket=FORMATTED_ZONE_BUCKET, Prefix=formatted_zone_path, PaginationConfig={'PageSize': 1000}
+        )
+        objects = (obj for page in pages for obj in page.get('Contents', []))
 
         file_key = None
-        for obj in objects['Contents']:
+        file_etag = None
+        found_any = False
+        for obj in objects:
+            found_any = True
             if not obj['Key'].endswith('/') and obj['Key'].lower().endswith('.json'):
                 file_key = obj['Key']
-                break 
+                file_etag = obj['ETag']
+                break
+
+        if not found_any:
+            logging.info(f"No files found in {formatted_zone_path}.")
+            return
 
         if not file_key:
              logging.warning(f"No .json files found directly under {formatted_zone_path}")
              return
 
+        base_name = file_key.split('/')[-1]
+        if not trusted_zone_path.endswith('/'):
+            trusted_zone_path += '/'
+        new_key = f"{trusted_zone_path}{base_name}"
+
+        # Skip the file if the trusted zone already holds the result for this source and processing version
+        if is_up_to_date(s3_client, TRUSTED_ZONE_BUCKET, new_key, file_etag, PROCESSING_VERSION):
+            logging.info(f"Skipping unchanged file: {file_key}")
+            return
+
         logging.info(f"Processing file: {file_key}")
         try:
-            response = s3_client.get_object(Bucket=os.getenv("FORMATTED_ZONE_BUCKET"), Key=file_key)
-            file_content = response['Body'].read().decode('utf-8')
-            raw_data = json.loads(file_content)
-        except (ClientError, json.JSONDecodeError, Exception) as e:
+            response = s3_client.get_object(Bucket=FORMATTED_ZONE_BUCKET, Key=file_key)
+            # orjson parses the raw bytes directly (no intermediate decoded string)
+            raw_data = orjson.loads(response['Body'].read())
+        except (ClientError, orjson.JSONDecodeError, Exception) as e:
             logging.error(f"Failed to load or parse JSON from {file_key}: {e}. Skipping file.")
             return
 
@@ -169,13 +320,14 @@ def process_json_trusted(s3_client, formatted_zone_path, trusted_zone_path, requ
         total_entries_read = len(raw_data)
         logging.info(f"Read {total_entries_read} entries from {file_key}.")
 
+        validate_and_clean_entry = VALIDATORS[dataset_name]
         for game_id, game_data in raw_data.items():
             if not isinstance(game_data, dict):
                 logging.warning(f"[{dataset_name} ID: {game_id}] Entry data is not a dictionary. Skipping.")
                 invalid_entry_count += 1
                 continue
 
-            cleaned_entry = validate_and_clean_entry(game_id, game_data, required_keys, dataset_name)
+            cleaned_entry = validate_and_clean_entry(game_id, game_data)
 
             if cleaned_entry is not None:
                 processed_data[game_id] = cleaned_entry
@@ -188,18 +340,15 @@ def process_json_trusted(s3_client, formatted_zone_path, trusted_zone_path, requ
              logging.warning(f"No valid data remaining for {file_key} after cleaning. Nothing to upload.")
              return
 
-        standardized_data_str = json.dumps(processed_data, indent=4, sort_keys=True)
-
-        base_name = file_key.split('/')[-1]
-        if not trusted_zone_path.endswith('/'):
-            trusted_zone_path += '/'
-        new_key = f"{trusted_zone_path}{base_name}"
+        # Compact form (machine-read downstream); sorted keys keep the output stable across runs
+        standardized_data = orjson.dumps(processed_data, option=orjson.OPT_SORT_KEYS)
 
         s3_client.put_object(
-            Bucket=os.getenv("TRUSTED_ZONE_BUCKET"),
+            Bucket=TRUSTED_ZONE_BUCKET,
             Key=new_key,
-            Body=standardized_data_str.encode('utf-8'),
-            ContentType='application/json' 
+            Body=standardized_data,
+            ContentType='application/json',
+            Metadata=source_metadata(file_etag, PROCESSING_VERSION)
         )
         logging.info(f"Successfully processed and uploaded cleaned data to: {new_key}")
 
@@ -212,25 +361,14 @@ def process_json_trusted(s3_client, formatted_zone_path, trusted_zone_path, requ
 def main():
     s3_client = minio_init()
 
-    # process Steam API JSON files
-    logging.info("Starting Steam JSON Processing...")
-    process_json_trusted(
-        s3_client,
-        formatted_zone_path="json/steam/", 
-        trusted_zone_path="json/steam/", 
-        required_keys=STEAM_REQUIRED_KEYS,
-        dataset_name="Steam"
-    )
-
-    # process SteamSpy API JSON files
-    logging.info("Starting SteamSpy JSON Processing...")
-    process_json_trusted(
-        s3_client,
-        formatted_zone_path="json/steamspy/",
-        trusted_zone_path="json/steamspy/",
-        required_keys=STEAMSPY_REQUIRED_KEYS,
-        dataset_name="SteamSpy"
-    )
+    # process Steam API and SteamSpy API JSON files concurrently (independent files and keys)
+    logging.info("Starting Steam and SteamSpy JSON Processing...")
+    datasets = [
+        ("json/steam/", "json/steam/", "Steam"),
+        ("json/steamspy/", "json/steamspy/", "SteamSpy"),
+    ]
+    with ThreadPoolExecutor(max_workers=len(datasets)) as executor:
+        list(executor.map(lambda args: process_json_trusted(s3_client, *args), datasets))
 
     logging.info("JSON Processing Completed")
 
@@ -1,10 +1,16 @@
+import functools
+from fractions import Fraction
 import logging
+import shutil
+import subprocess
+import threading
 import ffmpeg
-import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 import dotenv
 import os
-from global_scripts.utils import minio_init, delete_items
+from global_scripts.utils import minio_init, is_up_to_date, source_metadata, delete_stale_items
 
 dotenv.load_dotenv(dotenv.find_dotenv())
 
@@ -14,95 +20,331 @@ logging.basicConfig(
     force=True 
 )
 
+# Bucket names, read once (not on every object)
+FORMATTED_ZONE_BUCKET = os.getenv("FORMATTED_ZONE_BUCKET")
+TRUSTED_ZONE_BUCKET = os.getenv("TRUSTED_ZONE_BUCKET")
+
 TARGET_WIDTH = 1280
 TARGET_HEIGHT = 720
 TARGET_FPS = 30
 
-def process_videos(s3_client, formatted_zone_prefix, trusted_zone_prefix):
+# Version of the processing below, stored on every trusted-zone object: bump it whenever
+# the output would change, so objects produced by an older version are regenerated
+PROCESSING_VERSION = '2'
+
+# Lifetime of the presigned source URL: ffmpeg issues range requests until the transcode
+# ends, so it is sized to the video (10 s per MB, at least 1 h, at most the 7 days SigV4 allows)
+PRESIGNED_URL_MIN_EXPIRY = 3600
+PRESIGNED_URL_SECONDS_PER_MB = 10
+PRESIGNED_URL_MAX_EXPIRY = 7 * 24 * 3600
+
+# ffmpeg/ffprobe messages of a source that could not be read (as opposed to a corrupted one)
+NETWORK_ERROR_MARKERS = (
+    'HTTP error',
+    'Server returned',
+    'Connection refused',
+    'Connection reset',
+    'Connection timed out',
+    'Network is unreachable',
+    'Failed to resolve hostname',
+    'I/O error',
+)
+
+# Videos processed concurrently (ffmpeg already uses several threads per transcode)
+VIDEO_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+
+# Concurrent NVENC sessions (consumer GPUs cap them, extra sessions fail to open):
+# when all are taken, a worker transcodes on the CPU instead of waiting for the GPU
+NVENC_SESSIONS = threading.BoundedSemaphore(3)
+
+# Videos above 8 MB are uploaded as multipart PUTs, several parts in flight at once
+VIDEO_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=10,
+    use_threads=True,
+)
+
+@functools.lru_cache(maxsize=None)
+def nvenc_available():
     """
-    Processes videos from the formatted zone and uploads them to the trusted zone.
-    
+    Checks once whether the local ffmpeg build has the NVENC H.264 encoder and a GPU is present.
+
+    :return: True if the hardware transcode path can be used
+    """
+    if shutil.which('nvidia-smi') is None:
+        return False
+    try:
+        encoders = subprocess.run(
+            ['ffmpeg', '-hide_banner', '-encoders'], capture_output=True, text=True, check=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return 'h264_nvenc' in encoders
+
+
+def meets_target_spec(probe):
+    """
+    Checks whether a probed video is already an H.264 MP4 at the target resolution and FPS,
+    so transcoding it would not change it.
+
+    :param probe: Output of ffmpeg.probe
+    :return: True if the video can be copied as is
+    """
+    if 'mp4' not in probe.get('format', {}).get('format_name', '').split(','):
+        return False
+
+    video_streams = [s for s in probe.get('streams', []) if s.get('codec_type') == 'video']
+    if len(video_streams) != 1:
+        return False
+    video = video_streams[0]
+
+    try:
+        fps = Fraction(video.get('r_frame_rate', '0/1'))
+    except (ValueError, ZeroDivisionError):
+        return False
+
+    return (
+        video.get('codec_name') == 'h264'
+        and video.get('width') == TARGET_WIDTH
+        and video.get('height') == TARGET_HEIGHT
+        and fps == TARGET_FPS
+    )
+
+
+def presigned_url_expiry(size):
+    """
+    Computes how long the presigned URL of a source video stays valid.
+
+    :param size: Size of the video in bytes
+    :return: Expiry in seconds
+    """
+    expiry = PRESIGNED_URL_SECONDS_PER_MB * size // (1024 * 1024)
+    return min(max(expiry, PRESIGNED_URL_MIN_EXPIRY), PRESIGNED_URL_MAX_EXPIRY)
+
+
+def is_network_error(error):
+    """
+    Checks whether an ffmpeg/ffprobe failure comes from reading the source over HTTP
+    (network error, 403, expired URL) rather than from the video itself.
+
+    :param error: ffmpeg.Error raised by ffmpeg.probe or the transcode
+    :return: True if the source could not be read
+    """
+    stderr = (error.stderr or b'').decode(errors='replace')
+    return any(marker in stderr for marker in NETWORK_ERROR_MARKERS)
+
+
+def build_transcode(source_url, use_gpu):
+    """
+    Builds the ffmpeg pipeline standardizing FPS and resolution, writing a fragmented MP4
+    (which can be written to a non-seekable pipe) to stdout.
+
+    :param source_url: URL of the source video
+    :param use_gpu: Decode, scale and encode on the GPU (NVDEC, scale_cuda, NVENC)
+    :return: ffmpeg output stream
+    """
+    if use_gpu:
+        # Frames stay in GPU memory from the decoder to the scaler
+        stream = ffmpeg.input(source_url, hwaccel='cuda', hwaccel_output_format='cuda')
+    else:
+        stream = ffmpeg.input(source_url)
+
+    # Standardize FPS
+    stream = ffmpeg.filter(stream, 'fps', fps=TARGET_FPS, round='up')
+
+    # Standardize resolution
+    if use_gpu:
+        stream = ffmpeg.filter(
+            stream,
+            'scale_cuda',
+            w=TARGET_WIDTH,
+            h=TARGET_HEIGHT,
+            force_original_aspect_ratio='decrease'
+        )
+        # Padding runs on the CPU (pad_cuda needs FFmpeg 6+); NVENC takes system-memory NV12
+        stream = ffmpeg.filter(stream, 'hwdownload')
+        stream = ffmpeg.filter(stream, 'format', 'nv12')
+    else:
+        stream = ffmpeg.filter(
+            stream,
+            'scale',
+            width=TARGET_WIDTH,
+            height=TARGET_HEIGHT,
+            force_original_aspect_ratio='decrease'
+        )
+    stream = ffmpeg.filter(
+        stream,
+        'pad',
+        width=TARGET_WIDTH,
+        height=TARGET_HEIGHT,
+        x='(ow-iw)/2',
+        y='(oh-ih)/2'
+    )
+
+    output_args = {'format': 'mp4', 'movflags': 'frag_keyframe+empty_moov', 'acodec': 'copy'}
+    if use_gpu:
+        output_args.update(vcodec='h264_nvenc', preset='p4', tune='hq', rc='vbr', cq=23)
+
+    return ffmpeg.output(stream, 'pipe:', **output_args).global_args('-loglevel', 'error')
+
+
+def process_video(s3_client, source, trusted_zone_prefix):
+    """
+    Processes a single video from the formatted zone and uploads it to the trusted zone.
+
+    Nothing touches the local disk: ffmpeg reads the source through a presigned URL (HTTP
+    range requests, so MP4s with a trailing moov atom stay seekable) and writes a fragmented
+    MP4 to its stdout, which is streamed to the trusted zone as a multipart upload.
+
+    Videos already produced from the same source version (same ETag) by the same
+    PROCESSING_VERSION are skipped, and
+    videos already at the target spec are copied server-side without transcoding.
+
     :param s3_client: Boto3 S3 client
-    :param formatted_zone_prefix: Prefix for the formatted zone
+    :param source: Tuple of (key, ETag) of the video in the formatted zone
     :param trusted_zone_prefix: Prefix for the trusted zone
+    :return: True if the video is up to date in the trusted zone, False otherwise
     """
+    key, etag = source
+
+    # Define new key for trusted zone
+    base_name = key.split('/')[-1]
+    new_key = f"{trusted_zone_prefix}{base_name}"
+
     try:
-        # List objects in the formatted zone
-        objects = s3_client.list_objects_v2(Bucket=os.getenv("FORMATTED_ZONE_BUCKET"), Prefix=formatted_zone_prefix)
-        if 'Contents' not in objects:
-            logging.info(f"No videos found in {formatted_zone_prefix}.")
-            return
+        if is_up_to_date(s3_client, TRUSTED_ZONE_BUCKET, new_key, etag, PROCESSING_VERSION):
+            logging.info(f'Skipping unchanged video {key}')
+            return True
+
+        logging.info(f'Processing video {key}')
+        # Fails with a ClientError (not a corruption) when the source is missing or forbidden
+        size = s3_client.head_object(Bucket=FORMATTED_ZONE_BUCKET, Key=key)['ContentLength']
+        source_url = s3_client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': FORMATTED_ZONE_BUCKET, 'Key': key},
+            ExpiresIn=presigned_url_expiry(size)
+        )
+
+        # Corruption check
+        probe = ffmpeg.probe(source_url)
+
+        # Already standardized: server-side copy instead of a transcode
+        if meets_target_spec(probe):
+            s3_client.copy_object(
+                Bucket=TRUSTED_ZONE_BUCKET,
+                CopySource={'Bucket': FORMATTED_ZONE_BUCKET, 'Key': key},
+                Key=new_key,
+                Metadata=source_metadata(etag, PROCESSING_VERSION),
+                MetadataDirective='REPLACE',
+                ContentType='video/mp4'
+            )
+            logging.info(f"Video {key} already meets the target spec. Copied to: {new_key}")
+            return True
+
+        logging.info(f"Successfully checked {key}. Applying transformations...")
 
-        for obj in objects['Contents']:
-            key = obj['Key']
-            if key.endswith('/'):
+        # Hardware transcode first when NVENC is available, software transcode otherwise
+        # (or when the GPU pipeline fails, e.g. on a codec NVDEC does not support)
+        for use_gpu in ([True, False] if nvenc_available() else [False]):
+            if use_gpu and not NVENC_SESSIONS.acquire(blocking=False):
                 continue
+            try:
+                stream = build_transcode(source_url, use_gpu)
 
-            with tempfile.NamedTemporaryFile(suffix='.mp4') as temp_in, \
-                 tempfile.NamedTemporaryFile(suffix='.mp4') as temp_out:
-                
-                logging.info(f'Processing video {key}')
+                # Run the process, uploading its output while it is being produced
+                # (stderr is not piped, so it can never fill up and block ffmpeg)
+                process = ffmpeg.run_async(stream, pipe_stdout=True, overwrite_output=True)
                 try:
-                    # Download file from MinIO to temp file
-                    s3_client.download_file(
-                        Bucket=os.getenv("FORMATTED_ZONE_BUCKET"),
-                        Key=key,
-                        Filename=temp_in.name
+                    s3_client.upload_fileobj(
+                        process.stdout,
+                        TRUSTED_ZONE_BUCKET,
+                        new_key,
+                        ExtraArgs={'ContentType': 'video/mp4'},
+                        Config=VIDEO_TRANSFER_CONFIG
                     )
+                finally:
+                    process.stdout.close()
+                    return_code = process.wait()
+            finally:
+                if use_gpu:
+                    NVENC_SESSIONS.release()
 
-                    # Corruption check
-                    _ = ffmpeg.probe(temp_in.name)
-                    logging.info(f"Successfully checked {key}. Applying transformations...")
+            if return_code == 0:
+                break
 
-                    # Create input stream
-                    stream = ffmpeg.input(temp_in.name)
+            # The upload only saw a truncated stream: do not leave it in the trusted zone
+            s3_client.delete_object(Bucket=TRUSTED_ZONE_BUCKET, Key=new_key)
+            if use_gpu:
+                logging.warning(f"GPU transcode failed for {key}. Retrying on CPU.")
+        else:
+            raise ffmpeg.Error('ffmpeg', None, None)
 
-                    # Standardize FPS
-                    stream = ffmpeg.filter(stream, 'fps', fps=TARGET_FPS, round='up')
+        # Only a complete transcode is marked as produced from this source: the object was
+        # uploaded without the metadata, so a crash before this point never looks up to date
+        s3_client.copy_object(
+            Bucket=TRUSTED_ZONE_BUCKET,
+            CopySource={'Bucket': TRUSTED_ZONE_BUCKET, 'Key': new_key},
+            Key=new_key,
+            Metadata=source_metadata(etag, PROCESSING_VERSION),
+            MetadataDirective='REPLACE',
+            ContentType='video/mp4'
+        )
 
-                    # Standardize resolution
-                    stream = ffmpeg.filter(
-                        stream,
-                        'scale',
-                        width=TARGET_WIDTH,
-                        height=TARGET_HEIGHT,
-                        force_original_aspect_ratio='decrease'
-                    )
-                    stream = ffmpeg.filter(
-                        stream,
-                        'pad',
-                        width=TARGET_WIDTH,
-                        height=TARGET_HEIGHT,
-                        x='(ow-iw)/2',  
-                        y='(oh-ih)/2'
-                    )
+        logging.info(f"Successfully standardized video: {key}")
+        logging.info(f"Successfully processed and uploaded: {new_key}")
+        return True
 
-                    # Define output
-                    stream = ffmpeg.output(stream, temp_out.name, acodec='copy')
+    except ffmpeg.Error as e:
+        if is_network_error(e):
+            logging.error(f"Failed to read video {key} from the formatted zone: {e.stderr.decode(errors='replace')}")
+        else:
+            logging.warning(f"Failed to process video {key}. File is corrupted. Skipping. {e}")
+    except ClientError as e:
+        logging.error(f"Boto3 error processing video {key}: {e}")
+    except Exception as e:
+        logging.error(f"Unexpected error processing video {key}: {e}")
+    return False
 
-                    # Run the process
-                    ffmpeg.run(stream, overwrite_output=True, quiet=True)
-                    logging.info(f"Successfully standardized video: {key}")
 
-                    # Define new key for trusted zone
-                    base_name = key.split('/')[-1]
-                    new_key = f"{trusted_zone_prefix}{base_name}"
+def process_videos(s3_client, formatted_zone_prefix, trusted_zone_prefix):
+    """
+    Processes videos from the formatted zone and uploads them to the trusted zone.
+    Videos are independent, so several are processed at once: each transcode runs in its
+    own ffmpeg subprocess and the transfers wait on the network, so threads are enough.
+    
+    :param s3_client: Boto3 S3 client
+    :param formatted_zone_prefix: Prefix for the formatted zone
+    :param trusted_zone_prefix: Prefix for the trusted zone
+    """
+    try:
+        # List objects in the formatted zone (paginated: a single call stops at 1000 keys).
+        # Keys are streamed page by page, so processing starts before the listing completes
+        paginator = s3_client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(
+            Bucket=FORMATTED_ZONE_BUCKET, Prefix=formatted_zone_prefix, PaginationConfig={'PageSize': 1000}
+        )
+        sources = []  # (key, ETag), filled as the pages are consumed by the pool
 
-                    # Upload to trusted zone
-                    s3_client.upload_file(
-                        Filename=temp_out.name, 
-                        Bucket=os.getenv("TRUSTED_ZONE_BUCKET"),
-                        Key=new_key
-                    )
-                    logging.info(f"Successfully processed and uploaded: {new_key}")
-                
-                except ffmpeg.Error as e:
-                    logging.warning(f"Failed to process video {key}. File is corrupted. Skipping. {e}")
-                except ClientError as e:
-                    logging.error(f"Boto3 error processing video {key}: {e}")
-                except Exception as e:
-                    logging.error(f"Unexpected error processing video {key}: {e}")
+        def list_sources():
+            for page in pages:
+                for obj in page.get('Contents', []):
+                    if not obj['Key'].endswith('/'):
+                        sources.append((obj['Key'], obj['ETag']))
+                        yield sources[-1]
+
+        with ThreadPoolExecutor(max_workers=VIDEO_WORKERS) as executor:
+            results = list(executor.map(lambda source: process_video(s3_client, source, trusted_zone_prefix), list_sources()))
+
+        # Remove the trusted-zone videos whose source is gone or could not be processed
+        keep_keys = {f"{trusted_zone_prefix}{key.split('/')[-1]}" for (key, _), ok in zip(sources, results) if ok}
+        delete_stale_items(s3_client, TRUSTED_ZONE_BUCKET, trusted_zone_prefix, keep_keys)
+
+        if not results:
+            logging.info(f"No videos found in {formatted_zone_prefix}.")
+            return
 
+        logging.info(f"{sum(results)}/{len(results)} videos up to date in the trusted zone.")
     except ClientError as e:
         logging.critical(f"Boto3 error listing videos in {formatted_zone_prefix}: {e}", exc_info=True)
     except Exception as e:
@@ -110,9 +352,9 @@ def process_videos(s3_client, formatted_zone_prefix, trusted_zone_prefix):
 
 
 def main():
+    # One client shared by the worker threads (pooled connections, see minio_init)
     s3_client = minio_init()
     logging.info("Connected to MinIO.")
-    delete_items(s3_client, bucket=os.getenv("TRUSTED_ZONE_BUCKET"), prefix="media/video/")
     process_videos(
         s3_client,
         formatted_zone_prefix="media/video/",